@@ -0,0 +1,314 @@
+import itertools
+import sqlite3
+import zlib
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from astrbot.api import logger
+from . import journal
+from .backup import EXPORT_TABLES, write_jsonl
+from .storage import READER_CONNECTIONS, XiuXianStorage, import_jsonl_into, reads, writes
+
+BACKENDS = ("sqlite", "memory", "sharded")
+# 按 user_id 归属分库的表；其余表（物品、宗门）只使用 0 号库，物品表在每个库里都有一份相同的种子数据
+USER_TABLES = ("players", "player_skills", "player_equipment", "inventory", "group_members", "reset_logs",
+               "economy_journal", "economy_checkpoints")
+REBALANCE_BATCH = 500
+
+
+def open_storage(backend: str, db_file: Path, shards: int = 4) -> XiuXianStorage:
+    '''按配置创建存储后端：sqlite 为单个数据库文件，memory 为纯内存库（测试与基准测试用），
+    sharded 按 user_id 把玩家分散到 shards 个数据库文件。'''
+    if backend == "memory":
+        return XiuXianStorage(":memory:")
+    if backend not in BACKENDS:
+        logger.warning(f"未知的存储后端 {backend}，使用 sqlite。")
+        backend = "sqlite"
+    if backend == "sharded" and shards > 1:
+        return ShardedStorage(db_file, shards)
+    # 曾经使用过分库时，按单库处理会看不到其余库文件中的玩家，由只有一个库的分库后端在启动时把他们迁回
+    if shard_path(db_file, 1).exists():
+        return ShardedStorage(db_file, 1)
+    return XiuXianStorage(db_file)
+
+
+def shard_path(db_file: Path, index: int) -> Path:
+    '''0 号库沿用原数据库文件，由单库切换到分库时已有数据留在原处，启动时再迁往各自的库。'''
+    db_file = Path(db_file)
+    return db_file if index == 0 else db_file.with_name(f"{db_file.stem}.shard{index}{db_file.suffix}")
+
+
+def lanes(route):
+    '''为写方法标注 route(self, *参数) -> 会写到的分库序号，AsyncStorage 只把它排进这些分库的写通道。'''
+
+    def decorate(fn):
+        fn._lanes = route
+        return fn
+
+    return decorate
+
+
+def _by_user(name: str):
+    '''生成按第一个参数 user_id 转发到所属分库的方法。'''
+    method = getattr(XiuXianStorage, name)
+
+    def routed(self, user_id, *args, **kwargs):
+        return method(self.shard_of(user_id), user_id, *args, **kwargs)
+
+    routed.__name__ = name
+    routed.__doc__ = method.__doc__
+    routed._db_mode = method._db_mode
+    routed._lanes = lambda self, user_id, *args, **kwargs: (self.index_of(user_id),)
+    return routed
+
+
+def _table_columns(cursor, table: str) -> list:
+    '''表的列名，不含自增 id：跨库搬运时 id 由目标库重新分配，同一玩家的行保持原先的先后顺序。'''
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [col['name'] for col in cursor.fetchall() if col['name'] != "id"]
+
+
+def _copy_rows(src, dst, table: str, where: str = "", params=()):
+    columns = _table_columns(src, table)
+    order = " ORDER BY id" if table in ("inventory", "reset_logs", "economy_journal") else ""
+    src.execute(f"SELECT {', '.join(columns)} FROM {table}{where}{order}", params)
+    insert = f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    while True:
+        rows = src.fetchmany(1000)
+        if not rows:
+            break
+        dst.executemany(insert, [tuple(row.values()) for row in rows])
+
+
+class ShardedStorage:
+    '''按 user_id 的 CRC32 把玩家分散到多个 SQLite 文件的存储后端，接口与 XiuXianStorage 相同。
+
+    每个库有自己的写连接与写通道，不同库的玩家写入互不排队，同一个库的写入按提交顺序执行。
+    只涉及一名玩家的操作直接交给所属的库；
+    批量写回、闭关结算、跨库的工作单元按库拆开，按库序号依次取得各库写锁后在各自的事务中执行，
+    全部语句成功后才逐库提交（提交阶段崩溃时各库之间可能不一致，这是不引入两阶段提交的代价）。
+    '''
+
+    def __init__(self, db_file, shards: int):
+        self.db_file = Path(db_file)
+        self.shards = []
+        try:
+            for index in range(shards):
+                self.shards.append(XiuXianStorage(shard_path(db_file, index), readers=READER_CONNECTIONS))
+        except BaseException:
+            self.close()
+            raise
+        self.write_lanes = shards
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    def index_of(self, user_id: str) -> int:
+        return zlib.crc32(str(user_id).encode("utf-8")) % len(self.shards)
+
+    def shard_of(self, user_id: str) -> XiuXianStorage:
+        return self.shards[self.index_of(user_id)]
+
+    @contextmanager
+    def _writers(self, indexes):
+        '''按序号升序取得多个库的写游标，块内全部成功后才提交；固定的加锁顺序避免写线程之间互相等待。'''
+        with ExitStack() as stack:
+            yield {index: stack.enter_context(self.shards[index].db.writer()) for index in sorted(set(indexes))}
+
+    def _indexes(self, user_ids) -> set:
+        return {self.index_of(user_id) for user_id in user_ids}
+
+    def _split(self, items, user_of) -> dict:
+        groups = {}
+        for item in items:
+            groups.setdefault(self.index_of(user_of(item)), []).append(item)
+        return groups
+
+    # --- 初始化 ---
+
+    def init_database(self, initial_items):
+        for shard in self.shards:
+            shard.init_database(initial_items)
+        # 上次完成迁移时的分库数记录在 0 号库的 PRAGMA application_id 中（0 表示从未记录，如单库或快照），
+        # 分库数不变时跳过对各库的全表扫描
+        with self.shards[0].db.reader() as cursor:
+            cursor.execute("PRAGMA application_id")
+            recorded = cursor.fetchone()['application_id']
+        if recorded != len(self.shards):
+            self._rebalance()
+            with self.shards[0].db.writer() as cursor:
+                cursor.execute(f"PRAGMA application_id = {len(self.shards)}")
+
+    def _rebalance(self):
+        '''把不属于本库的玩家（刚由单库切换或改变了分库数）连同其全部数据迁往所属的库。
+
+        分库数减少后多出的库文件也在此清空，文件本身保留，之后再增加分库数时照常使用。
+        '''
+        moved = sum(self._move_misplaced(shard, index) for index, shard in enumerate(self.shards))
+        index = len(self.shards)
+        while shard_path(self.db_file, index).exists():
+            retired = XiuXianStorage(shard_path(self.db_file, index), readers=1)
+            try:
+                moved += self._move_misplaced(retired)
+            finally:
+                retired.close()
+            index += 1
+        if moved:
+            logger.info(f"已把 {moved} 名玩家的数据迁往所属的分库。")
+
+    def _move_misplaced(self, source: XiuXianStorage, index: int = None) -> int:
+        '''把 source 中不属于第 index 个库的玩家迁出，index 为 None 表示已不再使用的库，迁出全部玩家。'''
+        with source.db.reader() as cursor:
+            cursor.execute("SELECT user_id FROM players UNION SELECT user_id FROM reset_logs "
+                           "UNION SELECT user_id FROM economy_checkpoints UNION SELECT user_id FROM economy_journal")
+            misplaced = [row['user_id'] for row in cursor.fetchall() if self.index_of(row['user_id']) != index]
+        for start in range(0, len(misplaced), REBALANCE_BATCH):
+            targets = self._split(misplaced[start:start + REBALANCE_BATCH], lambda user_id: user_id)
+            # 只在启动时执行，此时没有其他写入，不必按库序号加锁
+            with source.db.writer() as src, self._writers(targets) as cursors:
+                for target, user_ids in targets.items():
+                    where = f" WHERE user_id IN ({','.join('?' for _ in user_ids)})"
+                    for table in USER_TABLES:
+                        _copy_rows(src, cursors[target], table, where, user_ids)
+                        src.execute(f"DELETE FROM {table}{where}", user_ids)
+        return len(misplaced)
+
+    # --- 玩家 ---
+
+    get_player = _by_user("get_player")
+    update_player = _by_user("update_player")
+    create_player = _by_user("create_player")
+    has_reset_on = _by_user("has_reset_on")
+
+    @writes
+    @lanes(lambda self, user_id, reset_date: (0, self.index_of(user_id)))
+    def reset_player(self, user_id: str, reset_date: str):
+        self.shard_of(user_id).reset_player(user_id, reset_date)
+        if self.index_of(user_id):
+            with self.shards[0].db.writer() as cursor:
+                cursor.execute("DELETE FROM sects WHERE leader_id = ?", (user_id,))
+
+    @writes
+    @lanes(lambda self, batch, events=(): self._indexes([*batch, *(event[1] for event in events)]))
+    def update_players(self, batch: dict, events=()):
+        updates = self._split(batch.items(), lambda item: item[0])
+        events = self._split(events, lambda event: event[1])
+        with self._writers([*updates, *events]) as cursors:
+            for index, cursor in cursors.items():
+                self.shards[index]._update_players(cursor, dict(updates.get(index, ())))
+                journal.write_events(cursor, events.get(index, ()))
+
+    @writes
+    def settle_seclusion(self, batch: dict, events, now: float, exp_per_minute: int, root_rates: dict):
+        updates = self._split(batch.items(), lambda item: item[0])
+        events = self._split(events, lambda event: event[1])
+        rows = []
+        with self._writers(range(len(self.shards))) as cursors:
+            for index, cursor in cursors.items():
+                shard = self.shards[index]
+                shard._update_players(cursor, dict(updates.get(index, ())))
+                journal.write_events(cursor, events.get(index, ()))
+                rows.extend(shard._settle(cursor, now, exp_per_minute, root_rates))
+        return rows
+
+    @reads
+    def get_sect_name(self, sect_id: int):
+        return self.shards[0].get_sect_name(sect_id)
+
+    # --- 功法与装备 ---
+
+    get_loadout = _by_user("get_loadout")
+    has_skill = _by_user("has_skill")
+    get_equipped = _by_user("get_equipped")
+
+    # --- 排行榜 ---
+
+    @reads
+    def get_ranking_profiles(self):
+        return [row for shard in self.shards for row in shard.get_ranking_profiles()]
+
+    @reads
+    def get_group_members(self):
+        return [row for shard in self.shards for row in shard.get_group_members()]
+
+    @writes
+    @lanes(lambda self, pairs: self._indexes(pair[1] for pair in pairs))
+    def add_group_members(self, pairs):
+        groups = self._split(pairs, lambda pair: pair[1])
+        with self._writers(groups) as cursors:
+            for index, cursor in cursors.items():
+                cursor.executemany("INSERT OR IGNORE INTO group_members (group_id, user_id) VALUES (?, ?)",
+                                   groups[index])
+
+    # --- 物品与储物戒 ---
+
+    def get_items(self):
+        return self.shards[0].get_items()
+
+    get_inventory = _by_user("get_inventory")
+    get_item_quantities = _by_user("get_item_quantities")
+    has_item = _by_user("has_item")
+    get_item_quantity = _by_user("get_item_quantity")
+
+    @writes
+    @lanes(lambda self, player_updates, inventory_ops, events=(), versions=None: self._indexes(
+        [*player_updates, *(op[1] for op in inventory_ops), *(event[1] for event in events)]))
+    def commit_unit(self, player_updates: dict, inventory_ops: list, events=(), versions=None):
+        updates = self._split(player_updates.items(), lambda item: item[0])
+        ops = self._split(inventory_ops, lambda op: op[1])
+        events = self._split(events, lambda event: event[1])
+        with self._writers([*updates, *ops, *events]) as cursors:
+            for index, cursor in cursors.items():
+                self.shards[index]._commit_unit(cursor, dict(updates.get(index, ())), ops.get(index, []),
+                                                events.get(index, ()), versions or {})
+
+    # --- 经济流水 ---
+
+    @reads
+    def audit_economy(self, user_id: str = None) -> list:
+        if user_id:
+            return self.shard_of(user_id).audit_economy(user_id)
+        return sorted(mismatch for shard in self.shards for mismatch in shard.audit_economy())
+
+    @writes
+    def compact_journal(self, before_ts: int) -> int:
+        return sum(shard.compact_journal(before_ts) for shard in self.shards)
+
+    # --- 备份与导入导出 ---
+
+    @reads
+    def backup_to(self, target, pages_per_step: int):
+        '''把各库合并成一个单库快照：0 号库用在线备份 API 复制，其余各库的玩家数据逐表追加。
+
+        每个库各自在一个读事务中复制，快照可直接作为 sqlite 后端的数据库文件使用。
+        '''
+        self.shards[0].backup_to(target, pages_per_step)
+        dst = sqlite3.connect(str(target), isolation_level=None)
+        try:
+            # 快照里的玩家都在一个库中，清掉复制来的分库数，作为库文件恢复后启动时会重新迁移
+            dst.execute("PRAGMA application_id = 0")
+            for shard in self.shards[1:]:
+                with shard.db.reader() as src:
+                    src.execute("BEGIN")
+                    dst.execute("BEGIN")
+                    for table in USER_TABLES:
+                        _copy_rows(src, dst, table)
+                    dst.execute("COMMIT")
+        finally:
+            dst.close()
+
+    @reads
+    def export_jsonl(self, path) -> dict:
+        with ExitStack() as stack:
+            cursors = [stack.enter_context(shard.db.reader()) for shard in self.shards]
+            for cursor in cursors:
+                cursor.execute("BEGIN")
+            return write_jsonl(path, ((table, itertools.chain.from_iterable(
+                cursor.connection.execute(f"SELECT * FROM {table} ORDER BY rowid") for cursor in cursors))
+                                      for table in EXPORT_TABLES))
+
+    @writes
+    def import_jsonl(self, path) -> dict:
+        with self._writers(range(len(self.shards))) as cursors:
+            return import_jsonl_into(path, [cursors[index] for index in range(len(self.shards))],
+                                     lambda table, row: self.index_of(row["user_id"]) if "user_id" in row else 0)
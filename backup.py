@@ -0,0 +1,58 @@
+import gzip
+import json
+import shutil
+from pathlib import Path
+
+# 导出/导入的表，按导入时的依赖顺序排列
+EXPORT_TABLES = ("players", "player_skills", "player_equipment", "sects", "inventory")
+SNAPSHOT_PREFIX = "simple_xiuxian-"
+SNAPSHOT_SUFFIX = ".db.gz"
+EXPORT_SUFFIX = ".jsonl.gz"
+IMPORT_BATCH_SIZE = 1000
+# 导入时不保留的自增 id：分库导出的 id 在不同库之间会重复，按导出顺序重新分配
+IMPORT_SKIP_COLUMNS = {"inventory": {"id"}}
+
+
+def compress_snapshot(raw_path: Path) -> Path:
+    '''把备份出的数据库文件流式压缩为 .db.gz，并删除未压缩的文件。'''
+    archive = raw_path.with_name(raw_path.name + ".gz")
+    tmp = archive.with_name(archive.name + ".tmp")
+    with open(raw_path, "rb") as src, gzip.open(tmp, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    tmp.replace(archive)
+    raw_path.unlink()
+    return archive
+
+
+def rotate_snapshots(directory: Path, keep: int) -> list:
+    '''只保留最新的 keep 份快照，返回被删除的文件。文件名带时间戳，按名称排序即按时间排序。'''
+    snapshots = sorted(directory.glob(f"{SNAPSHOT_PREFIX}*{SNAPSHOT_SUFFIX}"))
+    removed = snapshots[:-keep] if keep > 0 else []
+    for path in removed:
+        path.unlink()
+    return removed
+
+
+def write_jsonl(path: Path, tables) -> dict:
+    '''tables 为 [(表名, 行迭代器)]，每行写成 {"table": 表名, "row": {...}}，返回各表行数。'''
+    counts = {}
+    tmp = path.with_name(path.name + ".tmp")
+    with gzip.open(tmp, "wt", encoding="utf-8") as out:
+        for table, rows in tables:
+            counts[table] = 0
+            for row in rows:
+                out.write(json.dumps({"table": table, "row": row}, ensure_ascii=False))
+                out.write("\n")
+                counts[table] += 1
+    tmp.replace(path)
+    return counts
+
+
+def read_jsonl(path: Path):
+    '''逐行读取导出文件，产出 (表名, 行)。'''
+    opener = gzip.open if path.name.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as src:
+        for line in src:
+            if line.strip():
+                record = json.loads(line)
+                yield record["table"], record["row"]
@@ -0,0 +1,53 @@
+import random
+from typing import NamedTuple
+
+import numpy as np
+
+# 切磋规则：每回合先手方先出手，伤害为 max(1, 攻击 - 防御 + 浮动)；二十回合未分胜负即罢手，
+# 剩余气血多者胜，相同时判对手胜
+MAX_TURNS = 20
+DAMAGE_SPREAD = 5
+
+_rng = np.random.default_rng()
+
+
+def damage(attack: int, defense: int) -> int:
+    return max(1, attack - defense + random.randint(-DAMAGE_SPREAD, DAMAGE_SPREAD))
+
+
+class DuelForecast(NamedTuple):
+    trials: int
+    win: float
+    loss: float
+    expected_turns: float
+
+
+def _first_lethal_turn(hp: int, damage_matrix) -> np.ndarray:
+    '''每场模拟中累计伤害首次达到 hp 的回合下标（0 基），始终未达到时为 MAX_TURNS。'''
+    lethal = np.cumsum(damage_matrix, axis=1) >= hp
+    return np.where(lethal.any(axis=1), lethal.argmax(axis=1), MAX_TURNS)
+
+
+def forecast_duel(attacker: dict, defender: dict, trials: int = 10000) -> DuelForecast:
+    '''以双方当前属性批量模拟 trials 场切磋，返回先手方的胜、负概率与期望回合数。
+
+    所有场次、所有回合的伤害浮动一次性生成，按回合累加后找出各自被击倒的回合，
+    无需逐回合循环。规则与 /切磋 相同：同一回合内先手方先出手，回合用尽时比较剩余气血。
+    '''
+    if attacker['hp'] <= 0 or defender['hp'] <= 0:
+        # 实战中不会进入回合，直接按剩余气血判定
+        win = 1.0 if attacker['hp'] > defender['hp'] else 0.0
+        return DuelForecast(trials, win, 1.0 - win, 0.0)
+    rolls = _rng.integers(-DAMAGE_SPREAD, DAMAGE_SPREAD + 1, size=(2, trials, MAX_TURNS))
+    dealt = np.maximum(1, attacker['attack'] - defender['defense'] + rolls[0])
+    taken = np.maximum(1, defender['attack'] - attacker['defense'] + rolls[1])
+    # 先手方在同一回合先出手，因此对方倒下的回合不晚于自己即为胜
+    kill_turn = _first_lethal_turn(defender['hp'], dealt)
+    death_turn = _first_lethal_turn(attacker['hp'], taken)
+    knocked_out = (kill_turn <= death_turn) & (kill_turn < MAX_TURNS)
+    # 双方都撑满回合时，与实战一样按剩余气血判定，气血相同算对手胜
+    capped = (kill_turn == MAX_TURNS) & (death_turn == MAX_TURNS)
+    outlasted = capped & (attacker['hp'] - taken.sum(axis=1) > defender['hp'] - dealt.sum(axis=1))
+    win = (knocked_out | outlasted).mean()
+    turns = np.minimum(np.minimum(kill_turn, death_turn) + 1, MAX_TURNS)
+    return DuelForecast(trials, float(win), float(1.0 - win), float(turns.mean()))
@@ -0,0 +1,116 @@
+'''离线基准测试用的 astrbot 替身模块。
+
+只实现插件实际用到的接口：filter 装饰器、AstrMessageEvent、Context、Star、register、
+StarTools.get_data_dir 与 logger。install() 必须在导入插件之前调用。
+'''
+import json
+import logging
+import sys
+import types
+from enum import Enum
+from pathlib import Path
+
+logger = logging.getLogger("astrbot")
+logger.addHandler(logging.NullHandler())
+logger.propagate = False
+
+_data_dir = Path(".")
+
+
+class _Filter:
+    class PermissionType(Enum):
+        ADMIN = "admin"
+        MEMBER = "member"
+
+    @staticmethod
+    def command(*names, **kwargs):
+        return lambda fn: fn
+
+    @staticmethod
+    def permission_type(permission):
+        return lambda fn: fn
+
+
+class _At:
+    type = "At"
+
+    def __init__(self, qq: str):
+        self.qq = qq
+
+    def json(self):
+        return json.dumps({"qq": self.qq})
+
+
+class AstrMessageEvent:
+    def __init__(self, sender_id: str, message_str: str = "", group_id: str = "bench", at: str = None):
+        self.sender_id = sender_id
+        self.message_str = message_str
+        self.group_id = group_id
+        self.at = at
+
+    def get_group_id(self):
+        return self.group_id
+
+    def get_sender_id(self):
+        return self.sender_id
+
+    def get_sender_name(self):
+        return f"道友{self.sender_id}"
+
+    def get_messages(self):
+        return [_At(self.at)] if self.at else []
+
+    def plain_result(self, text: str):
+        return text
+
+    def stop_event(self):
+        pass
+
+
+class Context:
+    def __init__(self):
+        self._values = {}
+
+    def get(self, key):
+        return self._values.get(key)
+
+    def set(self, key, value, ttl=None):
+        self._values[key] = value
+
+    def delete(self, key):
+        self._values.pop(key, None)
+
+
+class Star:
+    def __init__(self, context):
+        self.context = context
+
+
+def register(*args, **kwargs):
+    return lambda cls: cls
+
+
+class StarTools:
+    @staticmethod
+    def get_data_dir(name: str) -> Path:
+        return _data_dir / name
+
+
+def set_data_dir(path):
+    global _data_dir
+    _data_dir = Path(path)
+
+
+def install():
+    '''把替身模块注册到 sys.modules，之后 `from astrbot.api import logger` 等导入都会落到这里。'''
+    modules = {name: types.ModuleType(name) for name in
+               ("astrbot", "astrbot.api", "astrbot.api.event", "astrbot.api.star", "astrbot.core", "astrbot.core.star")}
+    modules["astrbot.api"].logger = logger
+    modules["astrbot.api.event"].filter = _Filter()
+    modules["astrbot.api.event"].AstrMessageEvent = AstrMessageEvent
+    modules["astrbot.api.star"].Context = Context
+    modules["astrbot.api.star"].Star = Star
+    modules["astrbot.api.star"].register = register
+    modules["astrbot.core"].AstrBotConfig = dict
+    modules["astrbot.core.star"].StarTools = StarTools
+    sys.modules.update(modules)
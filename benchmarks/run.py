@@ -0,0 +1,267 @@
+'''数据层与游戏数值辅助函数的离线基准测试。
+
+用法（在插件根目录下）:
+    python benchmarks/run.py [--sizes 1000,10000,100000] [--iterations 200] [--output result.json]
+
+每个规模在临时目录中新建一份 SQLite 数据库并灌入相应数量的玩家，astrbot 依赖由
+benchmarks/astrbot_stub.py 代替。结果以 JSON 输出，便于不同版本之间对比。
+'''
+import argparse
+import asyncio
+import importlib
+import json
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from datetime import datetime
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+PLUGIN_ROOT = BENCH_DIR.parent
+PACKAGE = "astrbot_plugin_simple_xiuxian"
+
+sys.path.insert(0, str(BENCH_DIR))
+import astrbot_stub  # noqa: E402
+
+astrbot_stub.install()
+_package = types.ModuleType(PACKAGE)
+_package.__path__ = [str(PLUGIN_ROOT)]
+sys.modules[PACKAGE] = _package
+plugin_main = importlib.import_module(f"{PACKAGE}.main")
+stats = importlib.import_module(f"{PACKAGE}.stats")
+unit_of_work = importlib.import_module(f"{PACKAGE}.unit_of_work")
+
+SECLUSION_EVERY = 4
+STOCK_ITEM_QUANTITY = 10 ** 9
+# 闭关结算每次更新全部闭关玩家，只测少量几次
+SETTLE_ITERATIONS = 5
+
+
+def _summary(name: str, players: int, samples_ns):
+    samples_us = sorted(ns / 1000 for ns in samples_ns)
+    return {"name": name, "players": players, "iterations": len(samples_us),
+            "mean_us": round(statistics.fmean(samples_us), 3), "median_us": round(statistics.median(samples_us), 3),
+            "p95_us": round(samples_us[int(len(samples_us) * 0.95) - 1], 3), "min_us": round(samples_us[0], 3)}
+
+
+def _populate(plugin, players: int, rng: random.Random):
+    '''直接用 executemany 灌入玩家，再重新载入排行榜。'''
+    catalog = plugin.catalog
+    passive_books = [item for item in catalog.of_type("skill_book") if item.effect.passive][:6]
+    now = time.time()
+    rows = []
+    skill_rows = []
+    for i in range(players):
+        skills = {book.effect.skill_name: dict(book.effect.params) for book in rng.sample(passive_books, 2)}
+        skill_rows.extend((f"p{i}", name, json.dumps(data, ensure_ascii=False)) for name, data in skills.items())
+        bonus = stats.full_bonus(skills, {}, catalog)
+        major = rng.randrange(len(plugin.REALM_CONFIG) - 1)
+        minor = rng.randint(1, plugin.REALM_CONFIG[major]["levels"])
+        in_seclusion = int(i % SECLUSION_EVERY == 0)
+        rows.append((f"p{i}", f"道友{i}", major, minor, rng.randrange(10 ** 7), rng.randrange(10 ** 6),
+                     rng.choice(list(plugin.SPIRIT_ROOTS)), in_seclusion, now - 3600 if in_seclusion else 0,
+                     100, 100, 10, 5, "2024-01-01 00:00:00",
+                     *(bonus[field] for field in stats.BONUS_FIELDS)))
+    columns = ("user_id, nickname, major_level, minor_level, exp, gold, spirit_root, is_seclusion, "
+               "seclusion_start_time, hp, max_hp, attack, defense, created_at, "
+               + ", ".join(stats.BONUS_FIELDS))
+    stock_item = catalog.shop_items()[0].item_id
+    # 分库后端按 user_id 把各行写入所属的库，单库后端只有一组
+    shards = {}
+    for table, table_rows in (("players", rows), ("player_skills", skill_rows),
+                              ("inventory", [(f"p{i}", stock_item, STOCK_ITEM_QUANTITY) for i in range(players)])):
+        for row in table_rows:
+            shards.setdefault(plugin.storage.shard_of(row[0]), {}).setdefault(table, []).append(row)
+    for shard, tables in shards.items():
+        with shard.db.writer() as cursor:
+            cursor.executemany(f"INSERT INTO players ({columns}) VALUES ({', '.join('?' * len(rows[0]))})",
+                               tables["players"])
+            cursor.executemany("INSERT INTO player_skills (user_id, skill_name, data) VALUES (?, ?, ?)",
+                               tables["player_skills"])
+            cursor.executemany("INSERT INTO inventory (user_id, item_id, quantity) VALUES (?, ?, ?)",
+                               tables["inventory"])
+    started = time.perf_counter_ns()
+    plugin.leaderboards.load(plugin.storage.get_ranking_profiles())
+    return stock_item, time.perf_counter_ns() - started
+
+
+def _time_sync(call):
+    started = time.perf_counter_ns()
+    call()
+    return time.perf_counter_ns() - started
+
+
+async def _time_async(iterations: int, make_call, before=None):
+    samples = []
+    for i in range(iterations):
+        if before:
+            before(i)
+        call = make_call(i)
+        started = time.perf_counter_ns()
+        await call
+        samples.append(time.perf_counter_ns() - started)
+    return samples
+
+
+async def _measure_bytes(players: int, build):
+    '''build() 产生的对象常驻内存时，平均每名玩家占用的字节数。'''
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = await build()
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del kept
+    return {"name": build.__name__, "players": players, "bytes_per_player": round(used / players, 1)}
+
+
+async def _drain(handler, event):
+    async for _ in handler(event):
+        pass
+
+
+async def _bench_size(players: int, iterations: int, rng: random.Random, backend: str, shards: int):
+    results = []
+    with tempfile.TemporaryDirectory(prefix="xiuxian-bench-") as tmp:
+        astrbot_stub.set_data_dir(tmp)
+        config = {"enabled_groups": ["bench"], "cache_flush_interval": 3600, "seclusion_settle_interval": 0,
+                  "user_rate_limit": 0, "group_rate_limit": 0, "coalesce_window_ms": 0,
+                  "storage_backend": backend, "storage_shards": shards}
+        plugin = plugin_main.XiuXianPlugin(astrbot_stub.Context(), config)
+        await plugin._wait_ready()
+        stock_item, load_ns = _populate(plugin, players, rng)
+        results.append(_summary("leaderboard_load", players, [load_ns]))
+        rows = plugin.storage.get_ranking_profiles()
+        results.append(_summary("decode_ranking_rows", players, [_time_sync(plugin.storage.get_ranking_profiles)]))
+
+        async def leaderboard_profiles():
+            plugin.leaderboards.load(rows)
+            return plugin.leaderboards
+
+        cached_count = min(players, plugin.player_cache.max_size)
+
+        async def player_cache_records():
+            for i in range(cached_count):
+                await plugin._get_player(f"p{i}", calculate_exp=False)
+            return plugin.player_cache
+
+        # 先清空再计量，只统计常驻的玩家资料与缓存记录
+        plugin.leaderboards.load([])
+        results.append(await _measure_bytes(players, leaderboard_profiles))
+        del rows
+        results.append(await _measure_bytes(cached_count, player_cache_records))
+        plugin.player_cache.clear()
+        # 已有数据的热启动：构造插件本身不做数据库操作，就绪时间包含迁移检查与载入内存索引。
+        # 内存库关闭即清空，沿用同一个插件实例继续测量
+        if backend != "memory":
+            await plugin.terminate()
+            started = time.perf_counter_ns()
+            plugin = plugin_main.XiuXianPlugin(astrbot_stub.Context(), config)
+            construct_ns = time.perf_counter_ns() - started
+            await plugin._wait_ready()
+            results.append(_summary("plugin_construct", players, [construct_ns]))
+            results.append(_summary("startup_ready", players, [time.perf_counter_ns() - started]))
+
+        def uid(i):
+            return f"p{rng.randrange(players)}"
+
+        secluded = [f"p{i}" for i in range(0, players, SECLUSION_EVERY)]
+        settled = [f"p{i}" for i in range(players) if i % SECLUSION_EVERY]
+        cold_ids = [uid(i) for i in range(iterations)]
+
+        def evict(i):
+            plugin.player_cache.discard(cold_ids[i])
+
+        results.append(_summary("get_player_cold", players, await _time_async(
+            iterations, lambda i: plugin._get_player(cold_ids[i], calculate_exp=False), evict)))
+        hot = settled[:iterations]
+        for user_id in hot + secluded[:iterations]:
+            await plugin._get_player(user_id, calculate_exp=False)
+        results.append(_summary("get_player_hot", players, await _time_async(
+            iterations, lambda i: plugin._get_player(hot[i % len(hot)]))))
+        results.append(_summary("get_player_seclusion", players, await _time_async(
+            iterations, lambda i: plugin._get_player(secluded[i % len(secluded)]))))
+        results.append(_summary("update_player", players, await _time_async(
+            iterations, lambda i: plugin._update_player(hot[i % len(hot)], {"gold": rng.randrange(10 ** 6)}))))
+        results.append(_summary("flush_player_cache", players, await _time_async(
+            1, lambda i: plugin._flush_player_cache())))
+        results.append(_summary("settle_seclusion", players, await _time_async(
+            SETTLE_ITERATIONS, lambda i: plugin._settle_seclusion())))
+        results.append(_summary("recalculate_stats", players, await _time_async(
+            iterations, lambda i: plugin._recalculate_stats(hot[i % len(hot)]))))
+        results.append(_summary("recalculate_stats_full", players, await _time_async(
+            iterations, lambda i: plugin._recalculate_stats(hot[i % len(hot)], full=True))))
+
+        async def remove_item(user_id):
+            uow = unit_of_work.UnitOfWork(plugin, "use")
+            await uow.player(user_id)
+            uow.remove_item(user_id, stock_item)
+            await uow.commit()
+
+        results.append(_summary("remove_item", players, await _time_async(
+            iterations, lambda i: remove_item(hot[i % len(hot)]))))
+
+        realm_samples = []
+        for _ in range(iterations):
+            major = rng.randrange(len(plugin.REALM_CONFIG))
+            started = time.perf_counter_ns()
+            plugin._get_realm_info(major, 1)
+            realm_samples.append(time.perf_counter_ns() - started)
+        results.append(_summary("get_realm_info", players, realm_samples))
+
+        for rank_type in ("修为", "境界", "财富"):
+            results.append(_summary(f"show_ranking_{rank_type}", players, await _time_async(
+                iterations, lambda i: _drain(lambda e: plugin.show_ranking(e, rank_type),
+                                             astrbot_stub.AstrMessageEvent(hot[i % len(hot)])))))
+            results.append(_summary(f"show_my_rank_{rank_type}", players, await _time_async(
+                iterations, lambda i: _drain(lambda e: plugin.show_my_rank(e, rank_type),
+                                             astrbot_stub.AstrMessageEvent(uid(i))))))
+        await plugin.terminate()
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PLUGIN_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="修仙插件数据层基准测试")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="玩家规模，逗号分隔")
+    parser.add_argument("--iterations", type=int, default=200, help="每项测量的调用次数")
+    parser.add_argument("--seed", type=int, default=20240101)
+    parser.add_argument("--backend", default="sqlite", choices=("sqlite", "memory", "sharded"), help="存储后端")
+    parser.add_argument("--shards", type=int, default=4, help="sharded 后端的分库数")
+    parser.add_argument("--output", help="结果写入的 JSON 文件，缺省输出到标准输出")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = []
+    for players in (int(size) for size in args.sizes.split(",")):
+        print(f"正在测试 {players} 名玩家...", file=sys.stderr)
+        results.extend(await _bench_size(players, args.iterations, rng, args.backend, args.shards))
+    report = {"meta": {"revision": _git_revision(), "timestamp": datetime.now().isoformat(timespec="seconds"),
+                       "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                       "platform": platform.platform(), "iterations": args.iterations, "seed": args.seed,
+                       "backend": args.backend, "shards": args.shards},
+              "results": results}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
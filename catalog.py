@@ -0,0 +1,83 @@
+import json
+from types import MappingProxyType
+from typing import Any, Mapping, NamedTuple, Optional, Tuple
+
+
+class ItemEffect(NamedTuple):
+    '''物品 data 字段解码后的效果记录。params 保留完整的原始键值，供少见的效果读取额外参数。'''
+    kind: Optional[str]
+    value: Any
+    stat: Optional[str]
+    target_major_level: Optional[int]
+    skill_name: Optional[str]
+    passive: bool
+    params: Mapping[str, Any]
+
+    @classmethod
+    def decode(cls, data_json: str) -> "ItemEffect":
+        data = json.loads(data_json or "{}")
+        return cls(kind=data.get("effect"), value=data.get("value", 0), stat=data.get("stat"),
+                   target_major_level=data.get("target_major_level"), skill_name=data.get("skill_name"),
+                   passive=data.get("type") == "passive", params=MappingProxyType(data))
+
+
+class Item(NamedTuple):
+    item_id: int
+    name: str
+    type: str
+    description: str
+    price: int
+    effect: ItemEffect
+
+
+class ItemCatalog:
+    '''只读的物品目录。
+
+    items 表在初始化后不再变化，启动时整体载入一次，data 字段预先解码为 ItemEffect，
+    之后按 id、名称、类型查询都不再访问数据库。
+    '''
+
+    def __init__(self, rows):
+        items = tuple(Item(row["item_id"], row["name"], row["type"], row["description"], row["price"] or 0,
+                           ItemEffect.decode(row["data"])) for row in rows)
+        self._items = items
+        self._by_id = MappingProxyType({item.item_id: item for item in items})
+        self._by_name = MappingProxyType({item.name: item for item in items})
+        by_type = {}
+        for item in items:
+            by_type.setdefault(item.type, []).append(item)
+        self._by_type = MappingProxyType({t: tuple(v) for t, v in by_type.items()})
+        self._shop_items = tuple(sorted((item for item in items if item.price > 0), key=lambda item: item.price))
+        # 突破丹按目标大境界索引，-1 表示任意境界通用
+        by_target = {}
+        for item in items:
+            if item.effect.kind == "breakthrough_rate":
+                by_target.setdefault(item.effect.target_major_level, []).append(item)
+        self._breakthrough_by_target = MappingProxyType({t: tuple(v) for t, v in by_target.items()})
+        self._breakthrough_all = tuple(item for items in by_target.values() for item in items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def by_id(self, item_id: int) -> Optional[Item]:
+        return self._by_id.get(item_id)
+
+    def by_name(self, name: str) -> Optional[Item]:
+        return self._by_name.get(name)
+
+    def of_type(self, item_type: str) -> Tuple[Item, ...]:
+        return self._by_type.get(item_type, ())
+
+    def shop_items(self) -> Tuple[Item, ...]:
+        '''坊市在售物品，按价格升序。'''
+        return self._shop_items
+
+    def all_breakthrough_elixirs(self) -> Tuple[Item, ...]:
+        return self._breakthrough_all
+
+    def breakthrough_elixirs(self, major_level: int) -> Tuple[Item, ...]:
+        '''适用于当前大境界突破的丹药，专用丹药排在通用丹药之前。'''
+        return self._breakthrough_by_target.get(major_level, ()) + self._breakthrough_by_target.get(-1, ())
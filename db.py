@@ -0,0 +1,208 @@
+import asyncio
+import contextvars
+import functools
+import queue
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from astrbot.api import logger
+from .metrics import count_commit, count_statement
+
+
+def _is_locked_error(e: Exception) -> bool:
+    msg = str(e).lower()
+    return isinstance(e, sqlite3.OperationalError) and ("locked" in msg or "busy" in msg)
+
+
+class ConnectionPool:
+    '''SQLite 长连接池。
+
+    一条写连接（串行使用）加若干只读连接，全部开启 WAL 与 synchronous=NORMAL，
+    读者不会被写者阻塞。遇到 "database is locked" 时按指数退避重试。
+    db_file 为 ":memory:" 时数据只存在于这一条写连接中，读操作也在持有写锁时使用它，供测试与基准测试使用。
+    '''
+
+    def __init__(self, db_file, row_factory=None, readers: int = 4, busy_timeout_ms: int = 5000,
+                 max_retries: int = 5, retry_base_delay: float = 0.05):
+        self.db_file = str(db_file)
+        self.in_memory = self.db_file == ":memory:"
+        self.row_factory = row_factory
+        self.busy_timeout_ms = busy_timeout_ms
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self._closed = False
+
+        # 写连接必须先于只读连接创建：它负责建库并切换到 WAL 模式
+        self._writer = self._connect(read_only=False)
+        self._writer_lock = threading.RLock()
+        self._readers = queue.Queue(maxsize=readers)
+        self._reader_slots = threading.Semaphore(readers)
+
+    def _connect(self, read_only: bool):
+        if read_only:
+            # 路径中的 ?、#、% 与空格在 URI 里有特殊含义，交给 as_uri() 转义
+            uri = Path(self.db_file).resolve().as_uri() + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=self.busy_timeout_ms / 1000)
+        else:
+            # isolation_level=None: 事务由 writer() 显式控制
+            conn = sqlite3.connect(self.db_file, check_same_thread=False, timeout=self.busy_timeout_ms / 1000,
+                                   isolation_level=None)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        if not read_only:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        if self.row_factory:
+            conn.row_factory = self.row_factory
+        # 每条语句计入当前指令的 SQL 次数
+        conn.set_trace_callback(count_statement)
+        return conn
+
+    def _retry(self, fn):
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except sqlite3.OperationalError as e:
+                if not _is_locked_error(e) or attempt >= self.max_retries:
+                    raise
+                delay = self.retry_base_delay * (2 ** attempt) * (1 + random.random())
+                attempt += 1
+                logger.warning(f"数据库繁忙，{delay:.2f}秒后进行第{attempt}次重试: {e}")
+                time.sleep(delay)
+
+    @contextmanager
+    def writer(self):
+        '''获取写游标，块内语句在同一个事务中执行，正常退出时提交，异常时回滚。'''
+        if self._closed:
+            raise sqlite3.ProgrammingError("连接池已关闭")
+        with self._writer_lock:
+            conn = self._writer
+            if conn.in_transaction:
+                # 嵌套使用时并入外层事务
+                yield conn.cursor()
+                return
+            self._retry(lambda: conn.execute("BEGIN IMMEDIATE"))
+            try:
+                yield conn.cursor()
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                self._retry(conn.commit)
+                count_commit()
+
+    @contextmanager
+    def reader(self):
+        '''获取只读游标，用于排行榜、坊市、储物戒等查询。'''
+        if self._closed:
+            raise sqlite3.ProgrammingError("连接池已关闭")
+        if self.in_memory:
+            with self._memory_reader() as cursor:
+                yield cursor
+            return
+        self._reader_slots.acquire()
+        try:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                conn = self._retry(lambda: self._connect(read_only=True))
+            try:
+                yield conn.cursor()
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                if self._closed:
+                    conn.close()
+                else:
+                    self._readers.put_nowait(conn)
+        finally:
+            self._reader_slots.release()
+
+    @contextmanager
+    def _memory_reader(self):
+        with self._writer_lock:
+            conn = self._writer
+            # 嵌套在写事务中时不能回滚外层事务
+            nested = conn.in_transaction
+            try:
+                yield conn.cursor()
+            finally:
+                if not nested and conn.in_transaction:
+                    conn.rollback()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._writer_lock:
+            self._writer.close()
+
+
+class DatabaseExecutor:
+    '''把阻塞的 SQLite 调用移出 asyncio 事件循环。
+
+    写操作按写通道排队，每条通道是一个单线程执行器，通道内严格按提交顺序执行：单库只有一条通道，
+    天然串行；分库时每个分库一条，不同分库的写入并行。同时写多个分库的操作在每条相关通道里各占一个位置，
+    等这些通道都轮到它时才由其中一条执行，其余通道在此期间等待。提交全部来自事件循环线程，
+    各通道中任意两个操作的先后一致，不会互相等待成环。读操作交给有界线程池，与写线程并行执行，互不阻塞。
+    '''
+
+    def __init__(self, readers: int = 4, write_lanes: int = 1):
+        self._write_lanes = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"xiuxian-db-writer-{lane}")
+                             for lane in range(max(1, write_lanes))]
+        self._read_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="xiuxian-db-reader")
+
+    def run_write(self, lanes, fn, *args, **kwargs) -> asyncio.Future:
+        '''在 lanes 列出的写通道上执行 fn。'''
+        lanes = sorted(set(lanes))
+        if len(lanes) == 1:
+            return self._run(self._write_lanes[lanes[0]], fn, *args, **kwargs)
+        call = functools.partial(contextvars.copy_context().run, functools.partial(fn, *args, **kwargs))
+        done = Future()
+        barrier = threading.Barrier(len(lanes))
+        finished = threading.Event()
+
+        def turn(leader: bool):
+            barrier.wait()
+            if not leader:
+                finished.wait()
+                return
+            try:
+                if done.set_running_or_notify_cancel():
+                    try:
+                        done.set_result(call())
+                    except BaseException as e:
+                        done.set_exception(e)
+            finally:
+                finished.set()
+
+        for lane in lanes:
+            self._write_lanes[lane].submit(turn, lane == lanes[0])
+        return asyncio.wrap_future(done)
+
+    def run_read(self, fn, *args, **kwargs) -> asyncio.Future:
+        return self._run(self._read_executor, fn, *args, **kwargs)
+
+    @staticmethod
+    def _run(executor, fn, *args, **kwargs) -> asyncio.Future:
+        '''在调用时立即提交到线程池并返回可 await 的 future。
+
+        不能写成协程：协程要等下一轮事件循环才真正提交，期间后发起的写入可能先进入写线程，
+        写回缓存时先取出的旧批次就会覆盖之后提交的新数据。
+        '''
+        # 带上调用方的 contextvars，数据库线程里的 SQL 计数才能归到发起的指令上
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return loop.run_in_executor(executor, context.run, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self._read_executor.shutdown(wait=True)
+        for lane in self._write_lanes:
+            lane.shutdown(wait=True)
@@ -0,0 +1,220 @@
+'''灵石与物品流水。
+
+每次经济变动记一行 (时间, user_id, 事由, 灵石增减, 物品 id, 数量增减)，只追加不修改。
+economy_checkpoints 保存每名玩家在某条流水之前的余额快照，replay 从快照出发依次叠加流水，
+即可重建或核对 players.gold 与储物戒数量；compact 把旧流水折叠进快照后删除。
+
+本模块只依赖标准库，也可以脱离机器人直接核对一份数据库或备份快照:
+    python journal.py simple_xiuxian_data.db [--user 用户ID] [--apply]
+'''
+import json
+import sqlite3
+import sys
+import time
+
+JOURNAL_COLUMNS = ("ts", "user_id", "kind", "gold", "item_id", "quantity")
+
+
+class EconomyJournal:
+    '''尚未入库的流水。随玩家缓存写回时在同一个事务里批量写入，灵石与对应流水同时落盘。'''
+
+    def __init__(self):
+        self._events = []
+
+    def __len__(self):
+        return len(self._events)
+
+    def extend(self, events):
+        self._events.extend(events)
+
+    def take(self, user_ids=None) -> list:
+        '''取出全部流水；给出 user_ids 时只取这些玩家的，其余按原顺序留在队列中。'''
+        if user_ids is None:
+            events, self._events = self._events, []
+            return events
+        taken, kept = [], []
+        for event in self._events:
+            (taken if event[1] in user_ids else kept).append(event)
+        self._events = kept
+        return taken
+
+    def restore(self, events):
+        '''写库失败时放回队首，保持先后顺序。'''
+        self._events = list(events) + self._events
+
+    def discard(self, user_id: str):
+        self._events = [event for event in self._events if event[1] != user_id]
+
+    def clear(self):
+        '''丢弃全部未入库的流水，用于整库导入之后。'''
+        self._events = []
+
+
+def make_event(user_id: str, kind: str, gold: int = 0, item_id: int = None, quantity: int = 0) -> tuple:
+    return int(time.time()), user_id, kind, gold, item_id, quantity
+
+
+def write_events(cursor, events):
+    if events:
+        cursor.executemany(f"INSERT INTO economy_journal ({', '.join(JOURNAL_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)",
+                           events)
+
+
+def apply_event(state: dict, event) -> dict:
+    '''state 为 {"gold": 数量, "items": {item_id: 数量}}，原地叠加一条流水。'''
+    if event["kind"] == "reset":
+        state["gold"] = 0
+        state["items"] = {}
+        return state
+    state["gold"] += event["gold"]
+    if event["item_id"] is not None and event["quantity"]:
+        items = state["items"]
+        quantity = items.get(event["item_id"], 0) + event["quantity"]
+        if quantity:
+            items[event["item_id"]] = quantity
+        else:
+            items.pop(event["item_id"], None)
+    return state
+
+
+def load_checkpoints(cursor, user_id: str = None) -> dict:
+    sql = "SELECT user_id, gold, items FROM economy_checkpoints"
+    cursor.execute(sql + " WHERE user_id = ?" if user_id else sql, (user_id,) if user_id else ())
+    return {row["user_id"]: {"gold": row["gold"], "items": {int(k): v for k, v in json.loads(row["items"]).items()}}
+            for row in cursor.fetchall()}
+
+
+def replay(cursor, user_id: str = None, through_id: int = None) -> dict:
+    '''从快照叠加流水，返回 {user_id: 余额状态}。through_id 限定只叠加到该条流水为止。'''
+    states = load_checkpoints(cursor, user_id)
+    conditions, params = [], []
+    if user_id:
+        conditions.append("user_id = ?")
+        params.append(user_id)
+    if through_id is not None:
+        conditions.append("id <= ?")
+        params.append(through_id)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor.execute(f"SELECT user_id, kind, gold, item_id, quantity FROM economy_journal{where} ORDER BY id", params)
+    while True:
+        rows = cursor.fetchmany(1000)
+        if not rows:
+            break
+        for row in rows:
+            state = states.setdefault(row["user_id"], {"gold": 0, "items": {}})
+            apply_event(state, row)
+    return states
+
+
+def current_balances(cursor, user_id: str = None) -> dict:
+    '''数据库中实际的灵石与储物戒数量，格式同 replay 的结果。'''
+    player_sql = "SELECT user_id, gold FROM players"
+    inventory_sql = "SELECT user_id, item_id, quantity FROM inventory WHERE quantity != 0"
+    params = ()
+    if user_id:
+        player_sql += " WHERE user_id = ?"
+        inventory_sql += " AND user_id = ?"
+        params = (user_id,)
+    cursor.execute(player_sql, params)
+    balances = {row["user_id"]: {"gold": row["gold"] or 0, "items": {}} for row in cursor.fetchall()}
+    cursor.execute(inventory_sql, params)
+    for row in cursor.fetchall():
+        if row["user_id"] in balances:
+            balances[row["user_id"]]["items"][row["item_id"]] = row["quantity"]
+    return balances
+
+
+def audit(cursor, user_id: str = None) -> list:
+    '''比对流水重建的余额与实际余额，返回 [(user_id, 流水余额, 实际余额)]。已删除的玩家按零余额比对。'''
+    expected = replay(cursor, user_id)
+    actual = current_balances(cursor, user_id)
+    empty = {"gold": 0, "items": {}}
+    return [(uid, expected.get(uid, empty), actual.get(uid, empty))
+            for uid in sorted(expected.keys() | actual.keys())
+            if expected.get(uid, empty) != actual.get(uid, empty)]
+
+
+def rebase(cursor):
+    '''以当前余额重建全部快照并清空流水，用于建表和整库导入之后。'''
+    cursor.execute("DELETE FROM economy_journal")
+    cursor.execute("DELETE FROM economy_checkpoints")
+    now = int(time.time())
+    cursor.executemany("INSERT INTO economy_checkpoints (user_id, gold, items, through_id, ts) VALUES (?, ?, ?, 0, ?)",
+                       [(uid, state["gold"], json.dumps(state["items"]), now)
+                        for uid, state in current_balances(cursor).items()])
+
+
+def compact(cursor, before_ts: int) -> int:
+    '''把 before_ts 之前的流水折叠进快照并删除，返回折叠的条数。
+
+    只折叠按 id 连续的前缀，保证快照之后的流水仍按原顺序叠加；余额归零且已删除的玩家不再保留快照。
+    '''
+    cursor.execute("SELECT MAX(id) AS through_id FROM economy_journal WHERE ts < ?", (before_ts,))
+    through_id = cursor.fetchone()["through_id"]
+    if through_id is None:
+        return 0
+    cursor.execute("SELECT COUNT(*) AS n FROM economy_journal WHERE id <= ?", (through_id,))
+    folded = cursor.fetchone()["n"]
+    cursor.execute("SELECT DISTINCT user_id FROM economy_journal WHERE id <= ?", (through_id,))
+    touched = [r["user_id"] for r in cursor.fetchall()]
+    states = replay(cursor, through_id=through_id)
+    cursor.execute("SELECT user_id FROM players")
+    existing = {r["user_id"] for r in cursor.fetchall()}
+    now = int(time.time())
+    for uid in touched:
+        state = states[uid]
+        if uid not in existing and not state["gold"] and not state["items"]:
+            cursor.execute("DELETE FROM economy_checkpoints WHERE user_id = ?", (uid,))
+            continue
+        cursor.execute(
+            "INSERT INTO economy_checkpoints (user_id, gold, items, through_id, ts) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET gold = excluded.gold, items = excluded.items, "
+            "through_id = excluded.through_id, ts = excluded.ts",
+            (uid, state["gold"], json.dumps(state["items"]), through_id, now))
+    cursor.execute("DELETE FROM economy_journal WHERE id <= ?", (through_id,))
+    return folded
+
+
+def _apply_rebuilt(cursor, states: dict):
+    '''把重建出的余额写回玩家表与储物戒，只修改已存在玩家的灵石与物品数量。'''
+    for uid, state in states.items():
+        cursor.execute("UPDATE players SET gold = ? WHERE user_id = ?", (state["gold"], uid))
+        if not cursor.rowcount:
+            continue
+        # 流水中已不存在的物品删掉，已装备的保留
+        keep = ",".join("?" * len(state["items"]))
+        cursor.execute(f"DELETE FROM inventory WHERE user_id = ? AND item_id NOT IN ({keep}) "
+                       "AND item_id NOT IN (SELECT item_id FROM player_equipment WHERE user_id = inventory.user_id)",
+                       (uid, *state["items"]))
+        for item_id, quantity in state["items"].items():
+            cursor.execute(
+                "INSERT INTO inventory (user_id, item_id, quantity) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id, item_id) DO UPDATE SET quantity = excluded.quantity", (uid, item_id, quantity))
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="按快照与流水核对或重建玩家的灵石与物品")
+    parser.add_argument("database", help="数据库文件或解压后的备份快照")
+    parser.add_argument("--user", help="只处理指定玩家")
+    parser.add_argument("--apply", action="store_true", help="把重建的余额写回数据库（请先停止机器人或在副本上操作）")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.database, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    mismatches = audit(cursor, args.user)
+    for uid, expected, actual in mismatches:
+        print(f"{uid}: 流水 {json.dumps(expected, ensure_ascii=False)} / 实际 {json.dumps(actual, ensure_ascii=False)}")
+    print(f"共 {len(mismatches)} 名玩家不一致。")
+    if args.apply and mismatches:
+        cursor.execute("BEGIN IMMEDIATE")
+        _apply_rebuilt(cursor, {uid: expected for uid, expected, _ in mismatches})
+        cursor.execute("COMMIT")
+        print("已按流水重建上述玩家的余额。")
+    conn.close()
+    return 1 if mismatches and not args.apply else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,305 @@
+import heapq
+import random
+from .records import Profile
+
+# 跳表层数用独立的随机源，不扰动游戏逻辑使用的全局 random
+_level_rng = random.Random()
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, level: int):
+        self.key = key
+        self.next = [None] * level
+        self.width = [1] * level
+
+
+class RankedSkipList:
+    '''可按名次索引的跳表（order-statistic 结构）。
+
+    每层指针记录跨越的元素个数，插入、删除、按键求名次、按名次取键均为 O(log n)。
+    键必须互不相同且可比较。
+    '''
+
+    MAX_LEVEL = 24
+
+    def __init__(self):
+        self._tail = _Node(None, 0)
+        self._head = _Node(None, self.MAX_LEVEL)
+        self._head.next = [self._tail] * self.MAX_LEVEL
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < self.MAX_LEVEL and _level_rng.random() < 0.5:
+            level += 1
+        return level
+
+    def _find_chain(self, key):
+        chain = [None] * self.MAX_LEVEL
+        steps = [0] * self.MAX_LEVEL
+        node = self._head
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level] is not self._tail and node.next[level].key < key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        return chain, steps
+
+    def bulk_load(self, sorted_keys):
+        '''用已排好序的键一次性建表，O(n)，只能在空表上调用。'''
+        assert self._size == 0
+        last = [self._head] * self.MAX_LEVEL
+        last_position = [0] * self.MAX_LEVEL
+        position = 0
+        for position, key in enumerate(sorted_keys, 1):
+            node = _Node(key, self._random_level())
+            for level in range(len(node.next)):
+                last[level].next[level] = node
+                last[level].width[level] = position - last_position[level]
+                last[level] = node
+                last_position[level] = position
+        for level in range(self.MAX_LEVEL):
+            last[level].next[level] = self._tail
+            last[level].width[level] = position + 1 - last_position[level]
+        self._size = position
+
+    def insert(self, key):
+        chain, steps_at_level = self._find_chain(key)
+        new = _Node(key, self._random_level())
+        steps = 0
+        for level in range(len(new.next)):
+            prev = chain[level]
+            new.next[level] = prev.next[level]
+            prev.next[level] = new
+            new.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(len(new.next), self.MAX_LEVEL):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        chain, _ = self._find_chain(key)
+        target = chain[0].next[0]
+        if target is self._tail or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), self.MAX_LEVEL):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def index(self, key) -> int:
+        '''返回比 key 小的元素个数，即 key 的 0 基名次。'''
+        node = self._head
+        position = 0
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level] is not self._tail and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def _node_at(self, index: int):
+        node = self._head
+        remaining = index + 1
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def __getitem__(self, index: int):
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        return self._node_at(index).key
+
+    def slice(self, start: int, stop: int):
+        '''按名次取 [start, stop) 区间的键，定位 O(log n)，之后沿底层链表顺序读取。'''
+        start = max(0, start)
+        stop = min(stop, self._size)
+        if start >= stop:
+            return []
+        node = self._node_at(start)
+        keys = []
+        for _ in range(stop - start):
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class Leaderboard:
+    '''单个榜单：把玩家的排序键（末尾附上 user_id 以区分并列）维护在跳表中。'''
+
+    def __init__(self, sort_key, fields):
+        self._sort_key = sort_key
+        self.fields = fields
+        self._keys = {}
+        self._list = RankedSkipList()
+
+    def __len__(self):
+        return len(self._list)
+
+    def load(self, profiles: dict):
+        keys = {user_id: self._sort_key(profile) + (user_id,) for user_id, profile in profiles.items()}
+        self._keys = keys
+        self._list = RankedSkipList()
+        self._list.bulk_load(sorted(keys.values()))
+
+    def upsert(self, user_id: str, profile: dict):
+        key = self._sort_key(profile) + (user_id,)
+        old_key = self._keys.get(user_id)
+        if old_key == key:
+            return
+        if old_key is not None:
+            self._list.remove(old_key)
+        self._list.insert(key)
+        self._keys[user_id] = key
+
+    def remove(self, user_id: str):
+        key = self._keys.pop(user_id, None)
+        if key is not None:
+            self._list.remove(key)
+
+    def rank(self, user_id: str):
+        '''返回 1 基名次，玩家不在榜上时返回 None。'''
+        key = self._keys.get(user_id)
+        if key is None:
+            return None
+        return self._list.index(key) + 1
+
+    def page(self, start_rank: int, count: int):
+        '''返回从 start_rank（1 基）开始的 [(名次, user_id)]。'''
+        keys = self._list.slice(start_rank - 1, start_rank - 1 + count)
+        return [(start_rank + i, key[-1]) for i, key in enumerate(keys)]
+
+    def top_among(self, user_ids, count: int):
+        '''在给定的玩家中排出前 count 名，返回 [(名次, user_id)]。只按成员数计算，与全服人数无关。'''
+        keys = heapq.nsmallest(count, (self._keys[uid] for uid in user_ids if uid in self._keys))
+        return [(i + 1, key[-1]) for i, key in enumerate(keys)]
+
+
+class LeaderboardService:
+    '''修为/境界/财富三个榜单的内存索引，以及各群的成员索引。
+
+    启动时从数据库载入一次，之后随 _update_player 等写入增量维护；前 N 名与个人名次都只查内存。
+    群榜只在本群成员中排名，结果按群缓存并记下该群的版本号；只有本群成员的排序字段或成员名单变化时
+    版本号才加一，其他群玩家的修为、灵石变化不会使本群的缓存失效。
+    '''
+
+    PROFILE_FIELDS = Profile.FIELDS[1:]
+
+    def __init__(self):
+        # 玩家资料为 records.Profile，排序键直接读属性
+        self.boards = {
+            "修为": Leaderboard(lambda p: (-p.exp,), {"exp"}),
+            "境界": Leaderboard(lambda p: (-p.major_level, -p.minor_level, -p.exp),
+                              {"major_level", "minor_level", "exp"}),
+            "财富": Leaderboard(lambda p: (-p.gold,), {"gold"}),
+        }
+        self.profiles = {}
+        self.groups = {}
+        self._member_of = {}
+        self._group_versions = {}
+        self._group_top_cache = {}
+        self._ranked_fields = set().union(*(board.fields for board in self.boards.values()))
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def load(self, rows):
+        '''rows 为 get_ranking_profiles 返回的 Profile 记录，直接作为常驻资料，不再复制。'''
+        self.profiles = {row.user_id: row for row in rows}
+        for board in self.boards.values():
+            board.load(self.profiles)
+        self._group_top_cache = {}
+
+    def add(self, user_id: str, record: dict):
+        profile = Profile(user_id, *(record[field] for field in self.PROFILE_FIELDS))
+        self.profiles[user_id] = profile
+        for board in self.boards.values():
+            board.upsert(user_id, profile)
+        self._touch_groups(user_id)
+
+    def update(self, user_id: str, data: dict):
+        profile = self.profiles.get(user_id)
+        if profile is None:
+            return
+        changed = {field for field in self.PROFILE_FIELDS if field in data and data[field] != profile[field]}
+        if not changed:
+            return
+        for field in changed:
+            profile[field] = data[field]
+        for board in self.boards.values():
+            if board.fields & changed:
+                board.upsert(user_id, profile)
+        if self._ranked_fields & changed:
+            self._touch_groups(user_id)
+
+    def _touch_groups(self, user_id: str):
+        for group_id in self._member_of.get(user_id, ()):
+            self._group_versions[group_id] = self._group_versions.get(group_id, 0) + 1
+
+    def remove(self, user_id: str):
+        self._touch_groups(user_id)
+        for group_id in self._member_of.pop(user_id, ()):
+            self.groups[group_id].discard(user_id)
+        if self.profiles.pop(user_id, None) is None:
+            return
+        for board in self.boards.values():
+            board.remove(user_id)
+
+    def load_groups(self, rows):
+        self.groups = {}
+        self._member_of = {}
+        self._group_top_cache = {}
+        for row in rows:
+            self.groups.setdefault(row["group_id"], set()).add(row["user_id"])
+            self._member_of.setdefault(row["user_id"], set()).add(row["group_id"])
+
+    def add_member(self, group_id: str, user_id: str) -> bool:
+        '''记录玩家在某群出现过，返回是否为新成员。'''
+        members = self.groups.setdefault(group_id, set())
+        if user_id in members:
+            return False
+        members.add(user_id)
+        self._member_of.setdefault(user_id, set()).add(group_id)
+        self._group_versions[group_id] = self._group_versions.get(group_id, 0) + 1
+        return True
+
+    def group_size(self, group_id: str) -> int:
+        return sum(1 for user_id in self.groups.get(group_id, ()) if user_id in self.profiles)
+
+    def group_top(self, board_name: str, group_id: str, count: int = 10):
+        stamp = (self._group_versions.get(group_id, 0), count)
+        cached = self._group_top_cache.get((board_name, group_id))
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, self.boards[board_name].top_among(self.groups.get(group_id, ()), count))
+            self._group_top_cache[(board_name, group_id)] = cached
+        return [(rank, self.profiles[user_id]) for rank, user_id in cached[1]]
+
+    def board_name(self, rank_type: str):
+        '''按子串匹配榜单名，与旧版 /修仙排行 的参数习惯一致。'''
+        for name in self.boards:
+            if name in rank_type:
+                return name
+        return None
+
+    def top(self, board_name: str, count: int = 10):
+        return [(rank, self.profiles[user_id]) for rank, user_id in self.boards[board_name].page(1, count)]
+
+    def around(self, board_name: str, user_id: str, radius: int = 2):
+        '''返回 (名次, [(名次, 玩家资料)])，列表包含该玩家及其前后各 radius 名。'''
+        board = self.boards[board_name]
+        rank = board.rank(user_id)
+        if rank is None:
+            return None, []
+        start = max(1, rank - radius)
+        entries = board.page(start, rank - start + radius + 1)
+        return rank, [(r, self.profiles[uid]) for r, uid in entries]
@@ -0,0 +1,102 @@
+import asyncio
+import functools
+import weakref
+from contextlib import asynccontextmanager
+
+
+class UserLocks:
+    '''按 user_id 分配的 asyncio 锁。
+
+    锁对象只被正在持有或等待它的协程强引用，登记表用 WeakValueDictionary，
+    玩家不再活跃后锁自动回收。一次锁多名玩家时按 user_id 排序依次获取，
+    任意两条指令的加锁顺序一致，不会互相等待成环。不同玩家的指令互不阻塞。
+    '''
+
+    def __init__(self):
+        self._locks = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        return len(self._locks)
+
+    def _lock(self, user_id: str) -> asyncio.Lock:
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
+
+    @asynccontextmanager
+    async def hold(self, *user_ids):
+        locks = [self._lock(user_id) for user_id in sorted(set(filter(None, user_ids)))]
+        acquired = []
+        try:
+            for lock in locks:
+                await lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+
+class CommandGate:
+    '''修改玩家数据的指令经 enter() 进入；exclusive() 关上闸门，等已进入的指令全部结束后独占执行。
+
+    闸门关闭期间新指令在门外等待，用于整库导入这类要求没有指令在途的操作。
+    '''
+
+    def __init__(self):
+        self._active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._open = asyncio.Event()
+        self._open.set()
+
+    @asynccontextmanager
+    async def enter(self):
+        # 被唤醒时闸门可能又被另一个独占操作关上，重新检查
+        while not self._open.is_set():
+            await self._open.wait()
+        self._active += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self._active -= 1
+            if not self._active:
+                self._idle.set()
+
+    @asynccontextmanager
+    async def exclusive(self):
+        while not self._open.is_set():
+            await self._open.wait()
+        self._open.clear()
+        try:
+            await self._idle.wait()
+            yield
+        finally:
+            self._open.set()
+
+
+def serialized(with_target: bool = False):
+    '''指令处理函数（异步生成器）的装饰器：经插件的 command_gate 进入，处理期间持有发送者的锁，
+    with_target 时连同被 @ 的玩家一起锁住。
+
+    群开关与限流在排队之前判定，刷屏的指令直接丢弃，不会占着锁或在闸门外等待。
+    '''
+
+    def decorate(handler):
+        @functools.wraps(handler)
+        async def wrapper(self, event, *args, **kwargs):
+            await self._wait_ready()
+            if not self._is_group_enabled(event):
+                return
+            user_ids = [event.get_sender_id()]
+            if with_target:
+                user_ids.append(self._get_at_target(event))
+            async with self.command_gate.enter(), self.user_locks.hold(*user_ids):
+                async for result in handler(self, event, *args, **kwargs):
+                    yield result
+
+        return wrapper
+
+    return decorate
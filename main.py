@@ -1,6 +1,6 @@
+import asyncio
 import time
 import random
-import sqlite3
 import json
 from pathlib import Path
 from datetime import datetime
@@ -9,6 +9,21 @@ from astrbot.api.star import Context, Star, register
 from astrbot.api import logger
 from astrbot.core import AstrBotConfig
 from astrbot.core.star import StarTools
+from .storage import AsyncStorage
+from .backends import open_storage
+from .player_cache import PlayerCache
+from .leaderboard import LeaderboardService
+from .catalog import ItemCatalog
+from .unit_of_work import UnitOfWork
+from .locks import CommandGate, UserLocks, serialized
+from .throttle import Coalescer, RateLimiter
+from .metrics import MetricsRegistry, instrumented
+from .battle import MAX_TURNS, damage, forecast_duel
+from .realms import RealmLadder
+from .records import Player, Profile
+from .journal import EconomyJournal
+from .backup import EXPORT_SUFFIX, SNAPSHOT_PREFIX, compress_snapshot, rotate_snapshots
+from .stats import BONUS_FIELDS, apply_delta, derive_stats, full_bonus, item_delta, player_bonus, skill_delta
 
 
 @register(
@@ -39,6 +54,8 @@ class XiuXianPlugin(Star):
             {"name": "渡劫期", "levels": 1, "exp_base": 100000000, "display": lambda l: "渡劫中"},
             {"name": "真仙", "levels": 1, "exp_base": 0, "display": lambda l: "逍遥真仙"},
         ]
+        # 境界阶梯在载入时展开，名称、所需修为、成功率与基础属性都只算一次
+        self.realms = RealmLadder(self.REALM_CONFIG)
         self.SPIRIT_ROOTS = {
             "金": {"rate": 1.5, "desc": "庚金之体，攻击犀利"}, "木": {"rate": 1.4, "desc": "草木之灵，生机勃勃"},
             "水": {"rate": 1.6, "desc": "壬水之躯，防御见长"}, "火": {"rate": 1.8, "desc": "烈火之魂，爆发力强"},
@@ -48,17 +65,115 @@ class XiuXianPlugin(Star):
         self.EXP_PER_MINUTE = 10
         self.INITIAL_GOLD = 100
         self.EQUIPMENT_SLOTS = ["weapon", "armor", "helmet", "boots", "accessory"]
+        self.DUEL_FORECAST_TRIALS = 10000
+        self.BREAKTHROUGH_CHAIN_LIMIT = 50
+        self.SHOP_CATEGORIES = {"丹药": "elixir", "功法": "skill_book"}
+        self.SHOP_PAGE_SIZE = 10
+        self.INVENTORY_PAGE_SIZE = 15
 
         self.data_path = StarTools.get_data_dir("astrbot_plugin_simple_xiuxian")
         self.data_path.mkdir(parents=True, exist_ok=True)
         self.db_file = self.data_path / "simple_xiuxian_data.db"
-        self._init_database()
+        # 存储后端：sqlite 单库、memory 纯内存（不落盘，重启即清空）、sharded 按玩家分散到多个库文件
+        self.storage_backend = config.get("storage_backend", "sqlite")
+        self.storage_shards = max(1, config.get("storage_shards", 4))
+        self.backup_dir = self.data_path / "backups"
+        # 以下三项由 _initialize 在后台建立，指令处理函数开头的 _wait_ready() 保证届时已就绪
+        self.storage = None
+        # 处理函数通过 self.store 以 await 方式访问数据库，阻塞的 SQLite 调用不在事件循环中执行
+        self.store = None
+        # items 表初始化后即为静态数据，整体载入内存并预解码效果字段
+        self.catalog = None
+        # 坊市各分类的分页文本，由物品目录渲染一次后复用，目录重新载入时清空
+        self._shop_pages = {}
 
         self.config = config
         self.enabled_groups = self.config.get("enabled_groups", [])
+        # 玩家记录写回缓存：读走内存，写只标脏，定期批量落盘，崩溃时最多丢失一个写回周期的进度
+        self.player_cache = PlayerCache(self.config.get("player_cache_size", 5000))
+        self.cache_flush_interval = max(1, self.config.get("cache_flush_interval", 10))
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        # 定期把所有闭关玩家的修为一次性结算入库，排行榜不再停留在入定时的修为；0 表示不启用
+        self.seclusion_settle_interval = max(0, self.config.get("seclusion_settle_interval", 300))
+        self._settle_task = None
+        self.last_settlement = None
+        # 定期在线备份数据库并压缩保存，只保留最近 backup_keep 份；间隔为 0 表示只在管理员指令时备份
+        self.backup_interval_hours = max(0, self.config.get("backup_interval_hours", 24))
+        self.backup_keep = max(1, self.config.get("backup_keep", 7))
+        self.BACKUP_PAGES_PER_STEP = 256
+        self._backup_lock = asyncio.Lock()
+        self._backup_task = None
+        # 各指令的耗时与 SQL 次数，供 /修仙性能 查看；可选定期导出为 Prometheus 文本格式
+        self.metrics = MetricsRegistry()
+        self.metrics_file = self.data_path / "metrics.prom" if self.config.get("metrics_prometheus_file", False) else None
+        # 排行榜常驻内存，启动时载入一次，之后随玩家数据的写入增量更新
+        self.leaderboards = LeaderboardService()
+        # 读改写玩家数据的指令按玩家加锁：同一玩家的指令依次执行，不同玩家之间互不阻塞
+        self.user_locks = UserLocks()
+        # 整库导入时关闭闸门，等在途的指令结束后再导入，期间新指令排队等待
+        self.command_gate = CommandGate()
+        # 令牌桶限流在读库之前拒绝刷屏的指令，玩家与群各有一份额度；每分钟条数为 0 表示不限
+        self.user_limiter = RateLimiter(self.config.get("user_rate_limit", 20) / 60,
+                                        self.config.get("user_rate_burst", 5))
+        self.group_limiter = RateLimiter(self.config.get("group_rate_limit", 300) / 60,
+                                         self.config.get("group_rate_burst", 30))
+        # 短时间内相同的只读请求（排行榜、切磋预测）只计算一次
+        self.coalescer = Coalescer(self.config.get("coalesce_window_ms", 1000) / 1000)
+        # 灵石与物品变动的流水：只改缓存的指令产生的流水先记在这里，与缓存在同一个事务中写回
+        self.journal = EconomyJournal()
+        self.journal_retention_days = max(1, self.config.get("journal_retention_days", 30))
+        # 新出现的群成员先记在内存里，随缓存写回批量入库
+        self._pending_members = []
+        # 建库迁移与载入内存索引在后台线程进行，不阻塞 AstrBot 加载插件；没有运行中的事件循环时推迟到第一条指令
+        self._ready = None
+        try:
+            self._ready = asyncio.get_running_loop().create_task(self._initialize())
+        except RuntimeError:
+            pass
         logger.info(f"修仙插件加载成功，生效群聊: {'所有群聊' if not self.enabled_groups else self.enabled_groups}")
 
+    def _initialize_sync(self):
+        storage = open_storage(self.storage_backend, self.db_file, self.storage_shards)
+        try:
+            storage.init_database(self._initial_items())
+            self.catalog = ItemCatalog(storage.get_items())
+            self._shop_pages = {}
+            self.leaderboards.load(storage.get_ranking_profiles())
+            self.leaderboards.load_groups(storage.get_group_members())
+        except BaseException:
+            storage.close()
+            raise
+        self.storage = storage
+
+    async def _initialize(self):
+        started = time.perf_counter()
+        await asyncio.get_running_loop().run_in_executor(None, self._initialize_sync)
+        self.store = AsyncStorage(self.storage)
+        self._ensure_background_tasks()
+        logger.info(f"修仙数据库就绪（{self.storage_backend}），载入 {len(self.leaderboards)} 名玩家，耗时 {time.perf_counter() - started:.2f} 秒。")
+
+    async def _wait_ready(self):
+        ready = self._ready
+        if ready is None:
+            ready = self._ready = asyncio.ensure_future(self._initialize())
+        try:
+            await asyncio.shield(ready)
+        except Exception:
+            # 初始化失败时下一条指令会重新尝试
+            if self._ready is ready:
+                self._ready = None
+            raise
+
     def _is_group_enabled(self, event: AstrMessageEvent) -> bool:
+        # 同一条消息只判定一次：@serialized 在排队加锁前已判定过时直接沿用结果，不会重复扣限流令牌
+        allowed = event.get_extra("xiuxian_allowed")
+        if allowed is None:
+            allowed = self._check_group(event)
+            event.set_extra("xiuxian_allowed", allowed)
+        return allowed
+
+    def _check_group(self, event: AstrMessageEvent) -> bool:
         # 尝试获取群号
         group_id = event.get_group_id()
         # 如果获取不到群号 (即 group_id 为 None)，说明是私聊
@@ -68,75 +183,28 @@ class XiuXianPlugin(Star):
         # 如果插件没有配置生效群聊列表，则默认对所有群聊生效
         if not self.enabled_groups:
             print(self.enabled_groups)
-            return True
+            self._note_group_member(group_id, event.get_sender_id())
+            return self._within_rate_limit(group_id, event.get_sender_id())
 
         # 如果当前群号在生效列表里，则允许通过
         if str(group_id) in self.enabled_groups:
-            return True
+            self._note_group_member(group_id, event.get_sender_id())
+            return self._within_rate_limit(group_id, event.get_sender_id())
 
         # 其他情况（即在群聊中，但该群未被启用），则阻止
         return False
 
-    def _get_db_connection(self):
-        try:
-            conn = sqlite3.connect(self.db_file, check_same_thread=False)
-            conn.row_factory = self._dict_factory
-            return conn
-        except sqlite3.Error as e:
-            logger.error(f"数据库连接失败: {e}")
-            return None
-
-    def _dict_factory(self, cursor, row):
-        d = {}
-        for idx, col in enumerate(cursor.description):
-            d[col[0]] = row[idx]
-        return d
-
-    def _init_database(self):
-        self.data_path.mkdir(exist_ok=True)
-        conn = self._get_db_connection()
-        if not conn: return
-        cursor = conn.cursor()
-
-        cursor.execute("PRAGMA table_info(players)")
-        columns = [col['name'] for col in cursor.fetchall()]
-        if 'level' in columns:
-            logger.info("检测到旧版玩家表，正在升级...")
-            cursor.execute("ALTER TABLE players RENAME TO players_old")
-            cursor.execute(
-                '''CREATE TABLE players (user_id TEXT PRIMARY KEY, nickname TEXT, major_level INTEGER DEFAULT 0, minor_level INTEGER DEFAULT 1, exp INTEGER DEFAULT 0, gold INTEGER DEFAULT 0, spirit_root TEXT, is_seclusion BOOLEAN DEFAULT 0, seclusion_start_time REAL DEFAULT 0, hp INTEGER DEFAULT 100, max_hp INTEGER DEFAULT 100, attack INTEGER DEFAULT 10, defense INTEGER DEFAULT 5, sect_id INTEGER, sect_role TEXT, equipment TEXT, skills TEXT, last_checkin_date TEXT, created_at TEXT)''')
-            cursor.execute(
-                "INSERT INTO players (user_id, nickname, major_level, exp, gold, spirit_root, is_seclusion, seclusion_start_time, hp, max_hp, attack, defense, sect_id, sect_role, equipment, skills, last_checkin_date, created_at) SELECT user_id, nickname, level, exp, gold, spirit_root, is_seclusion, seclusion_start_time, hp, max_hp, attack, defense, sect_id, sect_role, equipment, skills, last_checkin_date, created_at FROM players_old")
-            cursor.execute("DROP TABLE players_old")
-            logger.info("玩家表结构升级完成。")
-        else:
-            cursor.execute(
-                '''CREATE TABLE IF NOT EXISTS players (user_id TEXT PRIMARY KEY, nickname TEXT, major_level INTEGER DEFAULT 0, minor_level INTEGER DEFAULT 1, exp INTEGER DEFAULT 0, gold INTEGER DEFAULT 0, spirit_root TEXT, is_seclusion BOOLEAN DEFAULT 0, seclusion_start_time REAL DEFAULT 0, hp INTEGER DEFAULT 100, max_hp INTEGER DEFAULT 100, attack INTEGER DEFAULT 10, defense INTEGER DEFAULT 5, sect_id INTEGER, sect_role TEXT, equipment TEXT, skills TEXT, last_checkin_date TEXT, created_at TEXT)''')
-
-        cursor.execute(
-            '''CREATE TABLE IF NOT EXISTS items (item_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE, type TEXT, description TEXT, price INTEGER, data TEXT)''')
-        cursor.execute(
-            '''CREATE TABLE IF NOT EXISTS inventory (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, item_id INTEGER, quantity INTEGER, is_equipped BOOLEAN DEFAULT 0, FOREIGN KEY (user_id) REFERENCES players (user_id), FOREIGN KEY (item_id) REFERENCES items (item_id))''')
-        cursor.execute(
-            '''CREATE TABLE IF NOT EXISTS sects (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE, leader_id TEXT, announcement TEXT, level INTEGER DEFAULT 1, resources INTEGER DEFAULT 0, created_at TEXT)''')
-
-        # --- 新增逻辑 ---
-        # 创建重置日志表，用于记录每日重置次数
-        cursor.execute('''CREATE TABLE IF NOT EXISTS reset_logs (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, reset_date TEXT)''')
-        # --- 逻辑结束 ---
-
-        self._populate_initial_items(cursor)
-        conn.commit()
-        conn.close()
-        logger.info("数据库初始化检查完成。")
-
-    def _populate_initial_items(self, cursor):
-        cursor.execute("SELECT COUNT(*) FROM items")
-        if cursor.fetchone()['COUNT(*)'] > 10:
-            return
-
-        cursor.execute("DELETE FROM items")
+    def _within_rate_limit(self, group_id, user_id: str) -> bool:
+        '''先扣玩家的令牌再扣群的令牌；超出额度的指令直接忽略，不回复以免加剧刷屏。'''
+        if not self.user_limiter.allow(user_id):
+            logger.debug(f"玩家 {user_id} 指令过于频繁，已忽略。")
+            return False
+        if not self.group_limiter.allow(str(group_id)):
+            logger.debug(f"群 {group_id} 指令过于频繁，已忽略。")
+            return False
+        return True
 
+    def _initial_items(self):
         elixirs = [
             ('引气丹', 'elixir', '炼气期基础丹药，恢复100点修为。', 50, json.dumps({'effect': 'add_exp', 'value': 100})),
             ('凝血草', 'elixir', '凡人草药，恢复20点气血。', 20, json.dumps({'effect': 'add_hp', 'value': 20})),
@@ -268,168 +336,366 @@ class XiuXianPlugin(Star):
                    json.dumps({'skill_name': '大道无形', 'type': 'passive', 'effect': 'god_mode'})),
                   ('点石成金', 'skill_book', '【主动】消耗大量修为，随机获得灵石。', 10000,
                    json.dumps({'skill_name': '点石成金', 'type': 'active', 'effect': 'create_gold'}))]
-        all_items = elixirs + skills
-        cursor.executemany("INSERT INTO items (name, type, description, price, data) VALUES (?, ?, ?, ?, ?)", all_items)
-        logger.info(f"数据库已填充 {len(all_items)} 种初始物品。")
-
-    def _get_player(self, user_id: str, calculate_exp: bool = True):
-        conn = self._get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM players WHERE user_id = ?", (user_id,))
-        player = cursor.fetchone()
-        conn.close()
-        if not player: return None
-        if calculate_exp and player["is_seclusion"]:
+        return elixirs + skills
+
+    async def _get_player(self, user_id: str, calculate_exp: bool = True):
+        self._ensure_background_tasks()
+        player = self.player_cache.get(user_id)
+        if player is None:
+            generation = self.player_cache.generation
+            player = await self.store.get_player(user_id)
+            if self.player_cache.generation != generation:
+                # 读库期间导入了快照，读到的可能是导入前的行
+                return await self._get_player(user_id, calculate_exp)
+            if not player: return None
+            player = self.player_cache.put(user_id, player)
+            if player.get("exp_rate") is None:
+                # 新玩家与旧数据尚无被动加成缓存，按功法与装备补算一次后随缓存写回
+                bonus = full_bonus(*await self.store.get_loadout(user_id), self.catalog)
+                player.update(bonus)
+                self.player_cache.update(user_id, bonus)
+            if self.player_cache.has_evicted:
+                await self._flush_player_cache(evicted_only=True)
+        if calculate_exp and player.is_seclusion:
+            # 只做投影，不写库：闭关修为在真正被消耗或改变时才随 _exp_update 一起落盘
             now = time.time()
-            duration_minutes = (now - player["seclusion_start_time"]) / 60
-            if duration_minutes > 0:
-                skills = json.loads(player.get("skills") or "{}")
-                exp_rate_bonus = 1.0
-                for skill_data in skills.values():
-                    if skill_data.get('type') == 'passive' and skill_data.get("effect") == "exp_rate":
-                        exp_rate_bonus += skill_data.get("value", 0)
-                root_rate = self.SPIRIT_ROOTS[player["spirit_root"]]["rate"]
-                added_exp = int(duration_minutes * self.EXP_PER_MINUTE * root_rate * exp_rate_bonus)
-                player["exp"] += added_exp
-                player["seclusion_start_time"] = now
-                self._update_player(user_id, {"exp": player["exp"], "seclusion_start_time": now})
+            gained = self._seclusion_exp(player, now)
+            player.exp += gained
+            player.seclusion_banked_exp += gained
+            player.seclusion_start_time = now
         return player
 
-    def _update_player(self, user_id: str, data: dict):
-        conn = self._get_db_connection()
-        cursor = conn.cursor()
-        updates = ", ".join([f"{key} = ?" for key in data.keys()])
-        values = list(data.values())
-        values.append(user_id)
-        cursor.execute(f"UPDATE players SET {updates} WHERE user_id = ?", tuple(values))
-        conn.commit()
-        conn.close()
+    def _seclusion_exp(self, player: Player, now: float) -> int:
+        duration_minutes = (now - player.seclusion_start_time) / 60
+        if duration_minutes <= 0:
+            return 0
+        root_rate = self.SPIRIT_ROOTS[player.spirit_root]["rate"]
+        return int(duration_minutes * self.EXP_PER_MINUTE * root_rate * player.exp_rate)
+
+    def _exp_update(self, player: dict, new_exp: int) -> dict:
+        # 闭关中的玩家写入修为时，同时把闭关起点推进到投影时刻，已计入的修为不会被重复结算
+        data = {"exp": new_exp}
+        if player["is_seclusion"]:
+            data["seclusion_start_time"] = player["seclusion_start_time"]
+            data["seclusion_banked_exp"] = player["seclusion_banked_exp"]
+        return data
+
+    async def _update_player(self, user_id: str, data: dict):
+        self.leaderboards.update(user_id, data)
+        if not self.player_cache.update(user_id, data):
+            await self.store.update_player(user_id, data)
+
+    def _apply_persisted(self, user_id: str, data: dict):
+        # 已由存储层直接写库的玩家字段，同步到缓存与排行榜
+        self.player_cache.apply_persisted(user_id, data)
+        self.leaderboards.update(user_id, data)
+
+    def _note_group_member(self, group_id, user_id: str):
+        # 只记录已入道的玩家，群榜的成员集合不会混入只发过消息的群友
+        if user_id in self.leaderboards.profiles and self.leaderboards.add_member(str(group_id), user_id):
+            self._pending_members.append((str(group_id), user_id))
+
+    async def _flush_group_members(self):
+        pairs, self._pending_members = self._pending_members, []
+        # 期间已重置的玩家不再写入
+        pairs = [(group_id, user_id) for group_id, user_id in pairs
+                 if user_id in self.leaderboards.groups.get(group_id, ())]
+        if not pairs:
+            return
+
+        def restore():
+            self._pending_members = pairs + self._pending_members
+
+        await self._write_or_restore(self.store.add_group_members(pairs), restore)
+
+    async def _write_or_restore(self, write, restore):
+        '''等待写库完成，只有数据库报错时才调用 restore 把数据放回待写队列。
+
+        卸载时取消后台任务只中断这里的等待，写库线程仍会照常提交；先等它结束并按实际结果处理，
+        再把取消抛出，否则已经入库的字段与流水会被放回，在卸载时的最后一次写回中重复写入。
+        '''
+        task = asyncio.ensure_future(write)
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            await asyncio.wait([task])
+            if not task.cancelled() and task.exception() is not None:
+                restore()
+            raise
+        except Exception:
+            restore()
+            raise
+
+    def _restore_write_back(self, batch: dict, events: list):
+        self.player_cache.restore_dirty(batch)
+        self.journal.restore(events)
+
+    def _ensure_background_tasks(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+        if self._settle_task is None and self.seclusion_settle_interval:
+            self._settle_task = asyncio.create_task(self._settle_loop())
+        if self._backup_task is None and self.backup_interval_hours:
+            self._backup_task = asyncio.create_task(self._backup_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.cache_flush_interval)
+            try:
+                with self.metrics.track("[后台]缓存写回"):
+                    await self._flush_player_cache()
+                    await self._flush_group_members()
+            except Exception as e:
+                logger.error(f"玩家缓存写回失败: {e}")
+            self._export_metrics()
+
+    async def _settle_loop(self):
+        while True:
+            await asyncio.sleep(self.seclusion_settle_interval)
+            started = time.perf_counter()
+            try:
+                with self.metrics.track("[后台]闭关结算"):
+                    settled = await self._settle_seclusion()
+            except Exception as e:
+                logger.error(f"闭关修为结算失败: {e}")
+                continue
+            elapsed = time.perf_counter() - started
+            self.last_settlement = (settled, elapsed)
+            if settled:
+                logger.info(f"闭关修为结算完成：{settled} 名玩家，耗时 {elapsed * 1000:.1f} 毫秒。")
+
+    async def _settle_seclusion(self) -> int:
+        '''把所有闭关玩家截至此刻的修为一次性结算入库，返回结算人数。'''
+        rates = {root: info["rate"] for root, info in self.SPIRIT_ROOTS.items()}
+        async with self._flush_lock:
+            # 缓存中的脏字段随结算在同一事务里写回，结算建立在最新的修为与闭关起点之上
+            batch = self.player_cache.take_dirty()
+            events = self.journal.take()
+            rows = await self._write_or_restore(
+                self.store.settle_seclusion(batch, events, time.time(), self.EXP_PER_MINUTE, rates),
+                lambda: self._restore_write_back(batch, events))
+            self.player_cache.flush_done()
+            for row in rows:
+                data = {"exp": row["exp"], "seclusion_banked_exp": row["seclusion_banked_exp"],
+                        "seclusion_start_time": row["seclusion_start_time"]}
+                if self.player_cache.apply_settled(row["user_id"], data):
+                    self.leaderboards.update(row["user_id"], {"exp": row["exp"]})
+        return len(rows)
+
+    async def _backup_loop(self):
+        while True:
+            await asyncio.sleep(self.backup_interval_hours * 3600)
+            try:
+                with self.metrics.track("[后台]数据库备份"):
+                    await self._create_backup()
+                # 快照里已保留完整流水，此后把过期流水折叠进余额快照
+                with self.metrics.track("[后台]流水压缩"):
+                    await self._compact_journal()
+            except Exception as e:
+                logger.error(f"修仙数据库定时备份失败: {e}")
+
+    async def _compact_journal(self) -> int:
+        await self._flush_player_cache()
+        folded = await self.store.compact_journal(int(time.time()) - self.journal_retention_days * 86400)
+        if folded:
+            logger.info(f"已把 {folded} 条经济流水折叠进余额快照。")
+        return folded
+
+    async def _create_backup(self):
+        '''在线备份数据库并压缩为 backups/simple_xiuxian-时间.db.gz，返回 (压缩文件, 被轮换删除的文件数)。'''
+        async with self._backup_lock:
+            # 先写回缓存，快照里包含内存中尚未落盘的进度
+            await self._flush_player_cache()
+            self.backup_dir.mkdir(parents=True, exist_ok=True)
+            raw = self.backup_dir / f"{SNAPSHOT_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}.db"
+            started = time.perf_counter()
+            await self.store.backup_to(raw, self.BACKUP_PAGES_PER_STEP)
+            loop = asyncio.get_running_loop()
+            archive = await loop.run_in_executor(None, compress_snapshot, raw)
+            removed = await loop.run_in_executor(None, rotate_snapshots, self.backup_dir, self.backup_keep)
+            logger.info(f"修仙数据库已备份到 {archive.name}（{archive.stat().st_size / 1024:.0f} KB），"
+                        f"耗时 {time.perf_counter() - started:.2f} 秒，清理旧备份 {len(removed)} 份。")
+            return archive, len(removed)
+
+    async def _export_snapshot(self):
+        async with self._backup_lock:
+            await self._flush_player_cache()
+            self.backup_dir.mkdir(parents=True, exist_ok=True)
+            path = self.backup_dir / f"{SNAPSHOT_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}{EXPORT_SUFFIX}"
+            return path, await self.store.export_jsonl(path)
+
+    async def _import_snapshot(self, path):
+        '''导入 JSONL 文件，随后丢弃内存中的玩家缓存与未入库的流水并重新载入排行榜。'''
+        # 先关闭指令闸门并等在途的指令结束，导入期间没有指令修改缓存或追加流水
+        async with self.command_gate.exclusive(), self._backup_lock, self._flush_lock:
+            # 持有写回锁期间不会有缓存落盘，导入后旧缓存与流水整体作废，不会覆盖导入的数据
+            counts = await self.store.import_jsonl(path)
+            self.player_cache.clear()
+            self.journal.clear()
+            self.leaderboards.load(await self.store.get_ranking_profiles())
+            self.leaderboards.load_groups(await self.store.get_group_members())
+        return counts
+
+    def _export_metrics(self):
+        if not self.metrics_file:
+            return
+        try:
+            self.metrics.write_prometheus(self.metrics_file)
+        except OSError as e:
+            logger.error(f"导出性能统计失败: {e}")
+
+    async def _flush_player_cache(self, evicted_only: bool = False):
+        async with self._flush_lock:
+            if not self.player_cache.has_dirty and (evicted_only or not self.journal):
+                return
+            batch = self.player_cache.take_dirty(evicted_only)
+            # 流水与灵石同批入库：只写回被淘汰的记录时只取这些玩家的流水，其余玩家的留待下一次
+            events = self.journal.take(batch if evicted_only else None)
+            if not batch and not events:
+                self.player_cache.flush_done()
+                return
+            await self._write_or_restore(self.store.update_players(batch, events),
+                                         lambda: self._restore_write_back(batch, events))
+            self.player_cache.flush_done()
+
+    @staticmethod
+    def _parse_quantity(text: str):
+        '''拆分 "物品名称 数量" 形式的参数，未写数量时为 1；数量不是正整数时返回 (名称, None)。'''
+        parts = text.strip().rsplit(maxsplit=1)
+        if len(parts) == 2 and parts[1].lstrip("+-").isdigit():
+            quantity = int(parts[1])
+            return parts[0], quantity if quantity > 0 else None
+        return text.strip(), 1
+
+    @staticmethod
+    def _parse_page(text: str):
+        '''拆出参数末尾的页码，返回 (其余参数, 页码)；未写页码时为第 1 页，页码不是正整数时为 None。'''
+        parts = text.strip().rsplit(maxsplit=1)
+        if parts and parts[-1].lstrip("+-").isdigit():
+            page = int(parts[-1])
+            return (parts[0] if len(parts) == 2 else ""), page if page > 0 else None
+        return text.strip(), 1
+
+    def _shop_page_texts(self, category: str):
+        pages = self._shop_pages.get(category)
+        if pages is None:
+            items = self.catalog.shop_items()
+            if category:
+                items = [item for item in items if item.type == self.SHOP_CATEGORIES[category]]
+            title = f"--- 天机阁坊市·{category} ---" if category else "--- 欢迎光临天机阁坊市 ---"
+            chunks = [items[i:i + self.SHOP_PAGE_SIZE] for i in range(0, len(items), self.SHOP_PAGE_SIZE)] or [[]]
+            pages = self._shop_pages[category] = tuple(
+                "\n".join([title, *(f"【{item.name}】价格: {item.price} 灵石\n  描述: {item.description}" for item in chunk),
+                           f"\n第 {number}/{len(chunks)} 页，发送 /坊市 [丹药|功法] [页码] 翻页。",
+                           "使用 /购买 [物品名称] 来购买。"])
+                for number, chunk in enumerate(chunks, 1))
+        return pages
 
     def _get_realm_info(self, major_level: int, minor_level: int):
-        if major_level >= len(self.REALM_CONFIG):
-            major_level = len(self.REALM_CONFIG) - 1
-        realm = self.REALM_CONFIG[major_level]
-        name = realm['name']
-        display = realm['display'](minor_level)
-        max_minor = realm['levels']
-        exp_base = realm['exp_base']
-        exp_needed = int(exp_base * (minor_level ** 1.5) * (major_level * 1.2 + 1))
-        return {"full_name": f"{name}·{display}", "major_name": name, "minor_name": display, "major_level": major_level,
-                "minor_level": minor_level, "max_minor_level": max_minor, "exp_needed": exp_needed}
-
-    def _recalculate_stats(self, user_id: str):
-        player = self._get_player(user_id, calculate_exp=False)
-        if not player: return
-        major_level, minor_level = player['major_level'], player['minor_level']
-        base_attack = 10 + major_level * 10 + minor_level * 2
-        base_defense = 5 + major_level * 8 + minor_level
-        base_max_hp = 100 + major_level * 100 + minor_level * 10
-        eq_attack, eq_defense, eq_max_hp = 0, 0, 0
-        equipment = json.loads(player.get("equipment") or "{}")
-        if equipment:
-            conn = self._get_db_connection()
-            cursor = conn.cursor()
-            item_ids = tuple(equipment.values())
-            if item_ids:
-                cursor.execute(f"SELECT data FROM items WHERE item_id IN ({','.join('?' for _ in item_ids)})", item_ids)
-                items = cursor.fetchall()
-                for item in items:
-                    item_data = json.loads(item['data'])
-                    eq_attack += item_data.get('attack', 0)
-                    eq_defense += item_data.get('defense', 0)
-                    eq_max_hp += item_data.get('hp', 0)
-            conn.close()
-        skill_add_stats = {'attack': 0, 'defense': 0, 'max_hp': 0}
-        skill_percent_stats = {'attack': 1.0, 'defense': 1.0, 'max_hp': 1.0}
-        skills = json.loads(player.get("skills") or "{}")
-        for skill_data in skills.values():
-            if skill_data.get('type') == 'passive':
-                if skill_data.get('effect') == 'add_flat_stat':
-                    for stat, value in skill_data['value'].items():
-                        skill_add_stats[stat] = skill_add_stats.get(stat, 0) + value
-                elif skill_data.get('effect') == 'add_percent_stat':
-                    for stat, value in skill_data['value'].items():
-                        skill_percent_stats[stat] = skill_percent_stats.get(stat, 1.0) + value
-        total_attack = int((base_attack + eq_attack + skill_add_stats['attack']) * skill_percent_stats['attack'])
-        total_defense = int((base_defense + eq_defense + skill_add_stats['defense']) * skill_percent_stats['defense'])
-        total_max_hp = int((base_max_hp + eq_max_hp + skill_add_stats['max_hp']) * skill_percent_stats['max_hp'])
-        new_stats = {"attack": total_attack, "defense": total_defense, "max_hp": total_max_hp,
-                     "hp": min(player['hp'], total_max_hp)}
-        self._update_player(user_id, new_stats)
-
-    def _remove_item_from_inventory(self, user_id: str, item_id: int, quantity: int = 1):
-        conn = self._get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, quantity FROM inventory WHERE user_id = ? AND item_id = ?", (user_id, item_id))
-        item = cursor.fetchone()
-        if not item or item['quantity'] < quantity:
-            conn.close()
-            return False
-        if item['quantity'] > quantity:
-            cursor.execute("UPDATE inventory SET quantity = ? WHERE id = ?", (item['quantity'] - quantity, item['id']))
+        return self.realms.stage(major_level, minor_level)
+
+    def _stat_updates(self, player: dict, *deltas, loadout=None) -> dict:
+        '''按玩家记录中缓存的被动加成重算攻防血，返回需要写入的字段。
+
+        deltas 为 (加成增量, 1 或 -1)，学习功法、更换装备时只叠加变化部分；
+        传入 loadout（get_loadout 的结果）时从功法与装备全量重算加成，并与缓存值比对作为一致性校验。
+        '''
+        bonus = player_bonus(player)
+        if loadout is not None:
+            expected = full_bonus(*loadout, self.catalog)
+            drifted = [field for field in BONUS_FIELDS if abs(expected[field] - bonus[field]) > 1e-9]
+            if drifted:
+                logger.warning(f"玩家 {player['user_id']} 的被动加成缓存与全量计算不一致，已修正: {drifted}")
+            changes = expected
         else:
-            cursor.execute("DELETE FROM inventory WHERE id = ?", (item['id'],))
-        conn.commit()
-        conn.close()
-        return True
+            changes = {}
+            for delta, sign in deltas:
+                step = apply_delta(bonus, delta, sign)
+                bonus.update(step)
+                changes.update(step)
+        bonus.update(changes)
+        return {**changes, **derive_stats(self._get_realm_info(player['major_level'], player['minor_level']).base_stats,
+                                            player['hp'], bonus)}
+
+    async def _recalculate_stats(self, user_id: str, *deltas, full: bool = False):
+        player = await self._get_player(user_id, calculate_exp=False)
+        if not player: return
+        loadout = await self.store.get_loadout(user_id) if full else None
+        await self._update_player(user_id, self._stat_updates(player, *deltas, loadout=loadout))
 
     async def terminate(self):
+        if self._ready is not None and not self._ready.done():
+            try:
+                await self._ready
+            except Exception as e:
+                logger.error(f"修仙数据库初始化失败: {e}")
+        if self.store is None:
+            logger.info("修仙插件已卸载。")
+            return
+        for task in (self._flush_task, self._settle_task, self._backup_task):
+            if task:
+                task.cancel()
+        try:
+            await self._flush_player_cache()
+            await self._flush_group_members()
+        except Exception as e:
+            logger.error(f"卸载时写回玩家缓存失败: {e}")
+        self._export_metrics()
+        stats = self.player_cache.stats()
+        logger.info(f"玩家缓存命中 {stats['hits']} 次，未命中 {stats['misses']} 次，命中率 {stats['hit_rate']:.1%}")
+        self.store.close()
         logger.info("修仙插件已卸载。")
 
     @filter.command("我要修仙")
+    @instrumented
+    @serialized()
     async def start_xiuxian(self, event: AstrMessageEvent):
         '''踏上仙途，开启你的传说。'''
+        await self._wait_ready()
         if not self._is_group_enabled(event):
             event.stop_event()
             return
         user_id = event.get_sender_id()
-        if self._get_player(user_id, calculate_exp=False):
+        if await self._get_player(user_id, calculate_exp=False):
             yield event.plain_result("道友已经踏入仙途，无需重复入门。")
             event.stop_event()
             return
-        conn = self._get_db_connection()
-        cursor = conn.cursor()
         root_type = random.choice(list(self.SPIRIT_ROOTS.keys()))
-        cursor.execute(
-            "INSERT INTO players (user_id, nickname, gold, spirit_root, equipment, skills, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (user_id, event.get_sender_name(), self.INITIAL_GOLD, root_type, '{}', '{}',
-             datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-        conn.commit()
-        conn.close()
-        self._recalculate_stats(user_id)
+        await self.store.create_player(user_id, event.get_sender_name(), self.INITIAL_GOLD, root_type,
+                                       datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        self.leaderboards.add(user_id, {"nickname": event.get_sender_name(), "exp": 0, "gold": self.INITIAL_GOLD,
+                                        "major_level": 0, "minor_level": 1})
+        self._note_group_member(event.get_group_id(), user_id)
+        await self._recalculate_stats(user_id, full=True)
         root_info = self.SPIRIT_ROOTS[root_type]
-        realm_info = self._get_realm_info(0, 1)
+        stage = self._get_realm_info(0, 1)
         msg = (
-            f"仙路尽头谁为峰，一见道友皆成空！\n恭喜 {event.get_sender_name()} 踏入仙途！\n你的灵根是【{root_type}灵根】，{root_info['desc']}。\n获赠启动灵石：{self.INITIAL_GOLD}枚。\n当前境界：{realm_info['full_name']}\n发送 /修仙面板 查看状态，发送 /闭关 开始获取修为吧！")
+            f"仙路尽头谁为峰，一见道友皆成空！\n恭喜 {event.get_sender_name()} 踏入仙途！\n你的灵根是【{root_type}灵根】，{root_info['desc']}。\n获赠启动灵石：{self.INITIAL_GOLD}枚。\n当前境界：{stage.full_name}\n发送 /修仙面板 查看状态，发送 /闭关 开始获取修为吧！")
         yield event.plain_result(msg)
         event.stop_event()
 
     @filter.command("修仙面板")
+    @instrumented
     async def show_status(self, event: AstrMessageEvent):
         '''查看你当前的详细修仙状态。'''
+        await self._wait_ready()
         if not self._is_group_enabled(event):
             event.stop_event()
             return
         user_id = event.get_sender_id()
-        player = self._get_player(user_id)
+        player = await self._get_player(user_id)
         if not player:
             yield event.plain_result("你尚未踏入仙途，请发送 /我要修仙 开始。")
             event.stop_event()
             return
-        realm_info = self._get_realm_info(player['major_level'], player['minor_level'])
-        exp_to_next_level = realm_info['exp_needed']
+        stage = self._get_realm_info(player['major_level'], player['minor_level'])
+        exp_to_next_level = stage.exp_needed
         sect_name = "无"
         if player['sect_id']:
-            conn = self._get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT name FROM sects WHERE id = ?", (player['sect_id'],))
-            sect = cursor.fetchone()
-            conn.close()
-            if sect:
-                sect_name = sect['name']
+            sect_name = await self.store.get_sect_name(player['sect_id']) or sect_name
         status_msg = (f"--- 道友 {player['nickname']} 的信息 ---\n"
                       f"灵根: 【{player['spirit_root']}灵根】\n"
-                      f"境界: {realm_info['full_name']}\n"
+                      f"境界: {stage.full_name}\n"
                       f"修为: {player['exp']} / {exp_to_next_level}\n"
                       f"灵石: {player['gold']}\n"
                       f"宗门: {sect_name} ({player.get('sect_role', '无')})\n"
@@ -442,11 +708,14 @@ class XiuXianPlugin(Star):
         event.stop_event()
 
     @filter.command("闭关")
+    @instrumented
+    @serialized()
     async def start_seclusion(self, event: AstrMessageEvent):
         '''进入闭关状态，持续获得修为。'''
+        await self._wait_ready()
         if not self._is_group_enabled(event): return
         user_id = event.get_sender_id()
-        player = self._get_player(user_id, calculate_exp=False)
+        player = await self._get_player(user_id, calculate_exp=False)
         if not player:
             yield event.plain_result("你尚未踏入仙途。")
             event.stop_event()
@@ -455,16 +724,21 @@ class XiuXianPlugin(Star):
             yield event.plain_result("你正在闭关中，请勿打扰。")
             event.stop_event()
             return
-        self._update_player(user_id, {"is_seclusion": 1, "seclusion_start_time": time.time()})
+        now = time.time()
+        await self._update_player(user_id, {"is_seclusion": 1, "seclusion_start_time": now,
+                                            "seclusion_session_start": now, "seclusion_banked_exp": 0})
         yield event.plain_result("你已进入闭关状态，灵气正源源不断地汇入你的体内...\n(发送 /出关 来查看成果)")
         event.stop_event()
 
     @filter.command("出关")
+    @instrumented
+    @serialized()
     async def end_seclusion(self, event: AstrMessageEvent):
         '''结束闭关，结算本次修炼所得。'''
+        await self._wait_ready()
         if not self._is_group_enabled(event): return
         user_id = event.get_sender_id()
-        player = self._get_player(user_id, calculate_exp=False)
+        player = await self._get_player(user_id, calculate_exp=False)
         if not player:
             yield event.plain_result("你尚未踏入仙途。")
             event.stop_event()
@@ -473,25 +747,31 @@ class XiuXianPlugin(Star):
             yield event.plain_result("你并未在闭关状态。")
             event.stop_event()
             return
-        start_time = player["seclusion_start_time"]
-        current_exp = player["exp"]
-        updated_player = self._get_player(user_id, calculate_exp=True)
-        added_exp = updated_player['exp'] - current_exp
-        self._update_player(user_id, {"is_seclusion": 0})
-        duration_seconds = time.time() - start_time
+        now = time.time()
+        # 闭关期间的定期结算已把部分修为计入 exp 并推进了 seclusion_start_time，汇报时按整次闭关计算
+        start_time = player["seclusion_session_start"] or player["seclusion_start_time"]
+        added_exp = self._seclusion_exp(player, now)
+        new_exp = player["exp"] + added_exp
+        added_exp += player["seclusion_banked_exp"]
+        await self._update_player(user_id, {"exp": new_exp, "seclusion_start_time": now, "is_seclusion": 0})
+        duration_seconds = now - start_time
         hours, rem = divmod(duration_seconds, 3600)
         minutes, seconds = divmod(rem, 60)
         duration_str = f"{int(hours)}小时 {int(minutes)}分钟 {int(seconds)}秒"
-        msg = (f"闭关结束！\n本次闭关时长：{duration_str}\n共获得修为：{added_exp}\n当前总修为：{updated_player['exp']}\n")
+        msg = (f"闭关结束！\n本次闭关时长：{duration_str}\n共获得修为：{added_exp}\n当前总修为：{new_exp}\n")
         yield event.plain_result(msg)
         event.stop_event()
 
     @filter.command("突破")
+    @instrumented
+    @serialized()
     async def breakthrough(self, event: AstrMessageEvent):
-        '''消耗修为，尝试冲击下一境界。'''
+        '''消耗修为，尝试冲击下一境界。用法: /突破 [连续]'''
+        await self._wait_ready()
         if not self._is_group_enabled(event): return
         user_id = event.get_sender_id()
-        player = self._get_player(user_id)
+        uow = UnitOfWork(self, "breakthrough")
+        player = await uow.player(user_id)
         if not player:
             yield event.plain_result("你尚未踏入仙途。")
             event.stop_event()
@@ -500,59 +780,76 @@ class XiuXianPlugin(Star):
             yield event.plain_result("闭关期间心神不宁，无法突破，请先 /出关。")
             event.stop_event()
             return
-        major_level, minor_level = player['major_level'], player['minor_level']
-        realm_info = self._get_realm_info(major_level, minor_level)
-        if realm_info['major_name'] == "真仙":
+        stage = self._get_realm_info(player['major_level'], player['minor_level'])
+        if self.realms.next_stage(stage) is None:
             yield event.plain_result("恭喜道友！你已是此界之巅，无需再突破了！")
             event.stop_event()
             return
-        exp_needed = realm_info['exp_needed']
-        if player["exp"] < exp_needed:
-            yield event.plain_result(f"修为不足，无法突破！\n当前修为：{player['exp']}\n需要修为：{exp_needed}")
-            event.stop_event()
-            return
-        success_rate = 0.8 - major_level * 0.05 - minor_level * 0.01
-        conn = self._get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT T1.item_id, T2.data, T2.name FROM inventory AS T1 JOIN items AS T2 ON T1.item_id = T2.item_id WHERE T1.user_id = ? AND T2.type = 'elixir'",
-            (user_id,))
-        elixirs = cursor.fetchall()
-        conn.close()
-        elixir_bonus = 0
-        elixir_used_msg = ""
-        for elixir in elixirs:
-            data = json.loads(elixir['data'])
-            if data.get('effect') == 'breakthrough_rate' and (
-                    data.get('target_major_level') == major_level or data.get('target_major_level') == -1):
-                elixir_bonus += data.get('value', 0)
-                self._remove_item_from_inventory(user_id, elixir['item_id'])
-                elixir_used_msg = f"\n你服下了【{elixir['name']}】，感觉突破的把握更大了！(成功率+{elixir_bonus * 100:.1f}%)"
+        if player["exp"] < stage.exp_needed:
+            yield event.plain_result(f"修为不足，无法突破！\n当前修为：{player['exp']}\n需要修为：{stage.exp_needed}")
+            event.stop_event()
+            return
+        continuous = event.message_str.strip() == "连续"
+        elixirs = self.catalog.all_breakthrough_elixirs()
+        stock = await self.store.get_item_quantities(user_id, [elixir.item_id for elixir in elixirs])
+        used = {}
+        lines = []
+        start_stage = stage
+        attempts = successes = 0
+        # 连续模式在修为允许时反复尝试，所有结果在一个事务里提交、一条消息里回复
+        while True:
+            attempts += 1
+            elixir = next((e for e in self.catalog.breakthrough_elixirs(stage.major_level) if stock.get(e.item_id)), None)
+            elixir_bonus = 0
+            if elixir:
+                stock[elixir.item_id] -= 1
+                used[elixir.item_id] = used.get(elixir.item_id, 0) + 1
+                elixir_bonus = elixir.effect.value
+            success_rate = min(0.95, stage.success_rate + elixir_bonus)
+            new_exp = player["exp"] - stage.exp_needed
+            if random.random() < success_rate:
+                stage = self.realms.next_stage(stage)
+                successes += 1
+                uow.update(user_id, {"major_level": stage.major_level, "minor_level": stage.minor_level, "exp": new_exp})
+                outcome = f"成功突破到【{stage.full_name}】"
+            else:
+                new_exp = max(0, new_exp - int(stage.exp_needed * 0.2))
+                uow.update(user_id, {"exp": new_exp})
+                outcome = "突破失败，修为略有倒退"
+            lines.append(f"第{attempts}次: {outcome}" + (f"（服下【{elixir.name}】）" if elixir else ""))
+            if (not continuous or attempts >= self.BREAKTHROUGH_CHAIN_LIMIT or self.realms.next_stage(stage) is None
+                    or player["exp"] < stage.exp_needed):
                 break
-        success_rate = min(0.95, success_rate + elixir_bonus)
-        new_exp = player["exp"] - exp_needed
-        if random.random() < success_rate:
-            new_major, new_minor = major_level, minor_level + 1
-            if new_minor > realm_info['max_minor_level']:
-                new_major += 1
-                new_minor = 1
-            self._update_player(user_id, {"major_level": new_major, "minor_level": new_minor, "exp": new_exp})
-            self._recalculate_stats(user_id)
-            new_realm_info = self._get_realm_info(new_major, new_minor)
-            msg = (f"天降祥瑞，恭喜道友成功突破到了【{new_realm_info['full_name']}】！{elixir_used_msg}")
+        if successes:
+            uow.update(user_id, self._stat_updates(player))
+        for item_id, quantity in used.items():
+            uow.remove_item(user_id, item_id, quantity)
+        if not continuous:
+            elixir_used_msg = (f"\n你服下了【{elixir.name}】，感觉突破的把握更大了！(成功率+{elixir_bonus * 100:.1f}%)"
+                               if elixir else "")
+            if successes:
+                msg = f"天降祥瑞，恭喜道友成功突破到了【{stage.full_name}】！{elixir_used_msg}"
+            else:
+                msg = f"突破失败！你被心魔所噬，气息紊乱，修为略有倒退。{elixir_used_msg}"
         else:
-            new_exp = max(0, new_exp - int(exp_needed * 0.2))
-            self._update_player(user_id, {"exp": new_exp})
-            msg = (f"突破失败！你被心魔所噬，气息紊乱，修为略有倒退。{elixir_used_msg}")
+            msg = ("--- 连续突破 ---\n" + "\n".join(lines) +
+                   f"\n共尝试 {attempts} 次，成功 {successes} 次。\n"
+                   f"境界：{start_stage.full_name} → {stage.full_name}\n剩余修为：{player['exp']}")
+        if not await uow.commit():
+            msg = "物品移除失败，请联系管理员。"
         yield event.plain_result(msg)
         event.stop_event()
 
     @filter.command("修仙签到")
+    @instrumented
+    @serialized()
     async def daily_checkin(self, event: AstrMessageEvent):
         '''每日签到可领取奖励。'''
+        await self._wait_ready()
         if not self._is_group_enabled(event): return
         user_id = event.get_sender_id()
-        player = self._get_player(user_id)
+        uow = UnitOfWork(self, "checkin")
+        player = await uow.player(user_id)
         if not player:
             yield event.plain_result("你尚未踏入仙途。")
             event.stop_event()
@@ -566,79 +863,86 @@ class XiuXianPlugin(Star):
         exp_reward = random.randint(100, 300) + player['major_level'] * 50
         new_gold = player['gold'] + gold_reward
         new_exp = player['exp'] + exp_reward
-        self._update_player(user_id, {"gold": new_gold, "exp": new_exp, "last_checkin_date": today})
+        uow.update(user_id, {**self._exp_update(player, new_exp), "gold": new_gold, "last_checkin_date": today})
+        if not await uow.commit():
+            yield event.plain_result("道友操作过快，请稍后再试。")
+            event.stop_event()
+            return
         yield event.plain_result(f"签到成功！\n你获得了 {gold_reward} 灵石和 {exp_reward} 修为。")
         event.stop_event()
 
     @filter.command("使用")
+    @instrumented
+    @serialized()
     async def use_item(self, event: AstrMessageEvent):
-        '''使用储物戒中的消耗品。用法: /使用 [物品名称]'''
+        '''使用储物戒中的消耗品。用法: /使用 [物品名称] [数量]'''
+        await self._wait_ready()
         if not self._is_group_enabled(event): return
         user_id = event.get_sender_id()
-        player = self._get_player(user_id)
+        uow = UnitOfWork(self, "use")
+        player = await uow.player(user_id)
         if not player:
             yield event.plain_result("你尚未踏入仙途。")
             event.stop_event()
             return
-        item_name = event.message_str.strip()
-        if not item_name:
-            yield event.plain_result("请指定要使用的物品。用法: /使用 [物品名称]")
+        item_name, quantity = self._parse_quantity(event.message_str)
+        if not item_name or quantity is None:
+            yield event.plain_result("请指定要使用的物品。用法: /使用 [物品名称] [数量]")
             event.stop_event()
             return
-        conn = self._get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT T1.item_id, T2.data, T2.type FROM inventory AS T1 JOIN items AS T2 ON T1.item_id = T2.item_id WHERE T1.user_id = ? AND T2.name = ?",
-            (user_id, item_name))
-        item_to_use = cursor.fetchone()
-        conn.close()
-        if not item_to_use:
+        item_to_use = self.catalog.by_name(item_name)
+        owned = await self.store.get_item_quantity(user_id, item_to_use.item_id) if item_to_use else 0
+        if not owned:
             yield event.plain_result(f"你的储物戒里没有【{item_name}】。")
             event.stop_event()
             return
-        if item_to_use['type'] == 'skill_book':
-            yield event.plain_result(
-            f"【{item_name}】是功法秘籍，请使用 /学习 指令。")
+        if owned < quantity:
+            yield event.plain_result(f"你的储物戒里只有 {owned} 个【{item_name}】。")
             event.stop_event()
             return
-        item_id = item_to_use['item_id']
-        data = json.loads(item_to_use['data'])
-        effect = data.get('effect')
-        if not self._remove_item_from_inventory(user_id, item_id):
-            yield event.plain_result("物品移除失败，请联系管理员。")
+        if item_to_use.type == 'skill_book':
+            yield event.plain_result(
+            f"【{item_name}】是功法秘籍，请使用 /学习 指令。")
             event.stop_event()
             return
+        item_id = item_to_use.item_id
+        effect = item_to_use.effect.kind
+        # 批量使用时效果直接按数量合计，只结算一次
+        used = f"{quantity}个【{item_name}】" if quantity > 1 else f"【{item_name}】"
         if effect == 'add_exp':
-            value = data.get('value', 0)
-            self._update_player(user_id, {"exp": player['exp'] + value})
-            yield event.plain_result(f"你使用了【{item_name}】，一股暖流涌入丹田，修为了提升了 {value} 点！")
+            value = item_to_use.effect.value * quantity
+            uow.remove_item(user_id, item_id, quantity)
+            uow.update(user_id, self._exp_update(player, player['exp'] + value))
+            msg = f"你使用了{used}，一股暖流涌入丹田，修为了提升了 {value} 点！"
         elif effect == 'add_hp':
-            value = data.get('value', 0)
-            new_hp = min(player['max_hp'], player['hp'] + value)
-            self._update_player(user_id, {"hp": new_hp})
-            yield event.plain_result(f"你服下了【{item_name}】，伤势恢复了 {value} 点气血！")
+            value = item_to_use.effect.value * quantity
+            uow.remove_item(user_id, item_id, quantity)
+            uow.update(user_id, {"hp": min(player['max_hp'], player['hp'] + value)})
+            msg = f"你服下了{used}，伤势恢复了 {value} 点气血！"
         elif effect == 'permanent_stat':
-            stat = data.get('stat')
-            value = data.get('value')
-            self._update_player(user_id, {stat: player[stat] + value})
-            self._recalculate_stats(user_id)
-            yield event.plain_result(f"你炼化了【{item_name}】，感觉根基更加稳固，{stat}永久提升了{value}点！")
+            stat = item_to_use.effect.stat
+            value = item_to_use.effect.value * quantity
+            uow.remove_item(user_id, item_id, quantity)
+            uow.update(user_id, {stat: player[stat] + value})
+            uow.update(user_id, self._stat_updates(player))
+            msg = f"你炼化了{used}，感觉根基更加稳固，{stat}永久提升了{value}点！"
         else:
-            conn = self._get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("UPDATE inventory SET quantity = quantity + 1 WHERE user_id = ? AND item_id = ?",
-                           (user_id, item_id))
-            conn.commit()
-            conn.close()
-            yield event.plain_result(f"【{item_name}】似乎不能这样使用。")
+            msg = f"【{item_name}】似乎不能这样使用。"
+        if not await uow.commit():
+            msg = "物品移除失败，请联系管理员。"
+        yield event.plain_result(msg)
         event.stop_event()
 
     @filter.command("学习")
+    @instrumented
+    @serialized()
     async def learn_skill(self, event: AstrMessageEvent):
         '''学习功法秘籍。用法: /学习 [功法名称]'''
+        await self._wait_ready()
         if not self._is_group_enabled(event): return
         user_id = event.get_sender_id()
-        player = self._get_player(user_id)
+        uow = UnitOfWork(self, "learn")
+        player = await uow.player(user_id)
         if not player:
             yield event.plain_result("你尚未踏入仙途。")
             event.stop_event()
@@ -648,100 +952,117 @@ class XiuXianPlugin(Star):
             yield event.plain_result("请指定要学习的功法。用法: /学习 [功法名称]")
             event.stop_event()
             return
-        conn = self._get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT T1.item_id, T2.data FROM inventory AS T1 JOIN items AS T2 ON T1.item_id = T2.item_id WHERE T1.user_id = ? AND T2.name = ? AND T2.type = 'skill_book'",
-            (user_id, skill_book_name))
-        book_to_learn = cursor.fetchone()
-        conn.close()
-        if not book_to_learn:
+        book_to_learn = self.catalog.by_name(skill_book_name)
+        if not book_to_learn or book_to_learn.type != 'skill_book' or not await self.store.has_item(
+                user_id, book_to_learn.item_id):
             yield event.plain_result(f"你的储物戒里没有【{skill_book_name}】这本秘籍。")
             event.stop_event()
             return
-        book_id = book_to_learn['item_id']
-        book_data = json.loads(book_to_learn['data'])
-        skill_name = book_data.get('skill_name')
-        skills = json.loads(player.get('skills') or '{}')
-        if skill_name in skills:
+        book_id = book_to_learn.item_id
+        book_data = dict(book_to_learn.effect.params)
+        skill_name = book_to_learn.effect.skill_name
+        if await self.store.has_skill(user_id, skill_name):
             yield event.plain_result(f"你已经掌握了【{skill_name}】，无需重复学习。");
             event.stop_event()
             return
-        if self._remove_item_from_inventory(user_id, book_id):
-            skills[skill_name] = book_data
-            self._update_player(user_id, {"skills": json.dumps(skills)})
-            self._recalculate_stats(user_id)  # 学习被动功法后更新属性
+        uow.remove_item(user_id, book_id)
+        uow.learn(user_id, skill_name, book_data)
+        uow.update(user_id, self._stat_updates(player, (skill_delta(book_data), 1)))  # 学习被动功法后更新属性
+        if await uow.commit():
             yield event.plain_result(f"你潜心研读【{skill_book_name}】，成功领悟了【{skill_name}】！")
         else:
             yield event.plain_result("学习失败，请联系管理员。")
         event.stop_event()
 
+    def _format_rank_line(self, board_name: str, rank: int, p: Profile) -> str:
+        if board_name == "修为":
+            return f"第{rank}名: {p.nickname} - {p.exp} 点修为\n"
+        if board_name == "境界":
+            stage = self._get_realm_info(p.major_level, p.minor_level)
+            return f"第{rank}名: {p.nickname} - {stage.full_name}\n"
+        return f"第{rank}名: {p.nickname} - {p.gold} 灵石\n"
+
     @filter.command("修仙排行", "排行")
-    async def show_ranking(self, event: AstrMessageEvent, rank_type: str = "境界"):
-        '''查看服务器排行榜。用法: /修仙排行 [修为/境界/财富]'''
+    @instrumented
+    async def show_ranking(self, event: AstrMessageEvent, rank_type: str = "境界", group_rank_type: str = "境界"):
+        '''查看服务器排行榜。用法: /修仙排行 [本群] [修为/境界/财富]'''
+        await self._wait_ready()
         if not self._is_group_enabled(event): return
 
-        conn = self._get_db_connection()
-        cursor = conn.cursor()
-
-        if "修为" in rank_type:
-            title = "--- 修为排行榜 ---"
-            cursor.execute("SELECT nickname, exp FROM players ORDER BY exp DESC LIMIT 10")
-            players = cursor.fetchall()
-            msg = f"{title}\n"
-            for i, p in enumerate(players):
-                msg += f"第{i + 1}名: {p['nickname']} - {p['exp']} 点修为\n"
-        elif "境界" in rank_type:
-            title = "--- 境界排行榜 ---"
-            cursor.execute(
-                "SELECT nickname, major_level, minor_level FROM players ORDER BY major_level DESC, minor_level DESC, exp DESC LIMIT 10")
-            players = cursor.fetchall()
-            msg = f"{title}\n"
-            for i, p in enumerate(players):
-                realm_info = self._get_realm_info(p['major_level'], p['minor_level'])
-                msg += f"第{i + 1}名: {p['nickname']} - {realm_info['full_name']}\n"
-        elif "财富" in rank_type:
-            title = "--- 财富排行榜 ---"
-            cursor.execute("SELECT nickname, gold FROM players ORDER BY gold DESC LIMIT 10")
-            players = cursor.fetchall()
-            msg = f"{title}\n"
-            for i, p in enumerate(players):
-                msg += f"第{i + 1}名: {p['nickname']} - {p['gold']} 灵石\n"
-        else:
-            conn.close()
+        group_only = rank_type.startswith("本群")
+        if group_only:
+            rank_type = rank_type[len("本群"):] or group_rank_type
+        board_name = self.leaderboards.board_name(rank_type)
+        if not board_name:
             yield event.plain_result("无效的排行榜类型。支持的类型: 修为, 境界, 财富");
             return
 
-        conn.close()
+        group_id = str(event.get_group_id()) if group_only else None
+
+        async def render():
+            if group_id:
+                msg = f"--- 本群{board_name}排行榜 (共{self.leaderboards.group_size(group_id)}位道友) ---\n"
+                entries = self.leaderboards.group_top(board_name, group_id, 10)
+            else:
+                msg = f"--- {board_name}排行榜 ---\n"
+                entries = self.leaderboards.top(board_name, 10)
+            for rank, p in entries:
+                msg += self._format_rank_line(board_name, rank, p)
+            return msg
+
+        yield event.plain_result(await self.coalescer.run(("排行", board_name, group_id), render))
+        event.stop_event()
+
+    @filter.command("我的排名")
+    @instrumented
+    async def show_my_rank(self, event: AstrMessageEvent, rank_type: str = "境界"):
+        '''查看自己在排行榜上的名次及前后的道友。用法: /我的排名 [修为/境界/财富]'''
+        await self._wait_ready()
+        if not self._is_group_enabled(event): return
+        user_id = event.get_sender_id()
+        board_name = self.leaderboards.board_name(rank_type)
+        if not board_name:
+            yield event.plain_result("无效的排行榜类型。支持的类型: 修为, 境界, 财富")
+            return
+        rank, neighbours = self.leaderboards.around(board_name, user_id)
+        if rank is None:
+            yield event.plain_result("你尚未踏入仙途。")
+            event.stop_event()
+            return
+        msg = f"--- {board_name}排行榜 ---\n你位列第{rank}名 (共{len(self.leaderboards)}位道友)\n"
+        for r, p in neighbours:
+            line = self._format_rank_line(board_name, r, p)
+            msg += f"> {line}" if r == rank else line
         yield event.plain_result(msg)
         event.stop_event()
 
+    def _get_at_target(self, event: AstrMessageEvent):
+        for msg in event.get_messages():
+            if msg.type == 'At':
+                # 与 get_sender_id() 一致使用字符串，缓存与锁才能按同一个键找到玩家
+                return str(json.loads(msg.json())["qq"])
+        return None
+
     @filter.command("切磋")
+    @instrumented
+    @serialized(with_target=True)
     async def player_vs_player(self, event: AstrMessageEvent):
         '''与其他道友切磋一番。用法: /切磋 @用户'''
+        await self._wait_ready()
         if not self._is_group_enabled(event): return
         user_id = event.get_sender_id()
-        player1 = self._get_player(user_id)
+        uow = UnitOfWork(self, "duel")
+        player1 = await uow.player(user_id)
         if not player1: yield event.plain_result("你尚未踏入仙途。"); return
 
-        target_id = None
-        message_chain = event.get_messages()
-        for msg in message_chain:
-            if msg.type == 'At':
-                json_str = msg.json()
-                data = json.loads(json_str)
-                # print(data)
-                # print(data["qq"])
-                target_id = data["qq"]
-                break
-
+        target_id = self._get_at_target(event)
         if not target_id:
             yield event.plain_result("请@你要切磋的道友。")
             return
         if target_id == user_id:
             yield event.plain_result("道友，不可与自己为敌。")
             return
-        player2 = self._get_player(target_id)
+        player2 = await uow.player(target_id)
         if not player2:
             yield event.plain_result("对方尚未踏入仙途。")
             return
@@ -753,12 +1074,12 @@ class XiuXianPlugin(Star):
         turn = 0
         while p1_hp > 0 and p2_hp > 0:
             turn += 1
-            if turn > 20: battle_log += "双方大战二十回合，未分胜负，遂罢手言和。\n"; break
-            damage1 = max(1, p1_atk - p2_def + random.randint(-5, 5))
+            if turn > MAX_TURNS: battle_log += "双方大战二十回合，未分胜负，遂罢手言和。\n"; break
+            damage1 = damage(p1_atk, p2_def)
             p2_hp -= damage1
             battle_log += f"回合{turn}: {player1['nickname']}对{player2['nickname']}造成了{damage1}点伤害！({player2['nickname']}剩余{max(0, p2_hp)}气血)\n"
             if p2_hp <= 0: break
-            damage2 = max(1, p2_atk - p1_def + random.randint(-5, 5))
+            damage2 = damage(p2_atk, p1_def)
             p1_hp -= damage2
             battle_log += f"回合{turn}: {player2['nickname']}对{player1['nickname']}造成了{damage2}点伤害！({player1['nickname']}剩余{max(0, p1_hp)}气血)\n\n"
         if p1_hp > p2_hp:
@@ -767,44 +1088,87 @@ class XiuXianPlugin(Star):
             winner, loser = player2, player1
         reward = random.randint(10, 50)
         loser_gold_loss = min(loser['gold'], reward)
-        self._update_player(winner['user_id'], {'gold': winner['gold'] + loser_gold_loss, 'hp': winner['max_hp']})
-        self._update_player(loser['user_id'], {'gold': loser['gold'] - loser_gold_loss, 'hp': loser['max_hp']})
+        uow.update(winner['user_id'], {'gold': winner['gold'] + loser_gold_loss, 'hp': winner['max_hp']})
+        uow.update(loser['user_id'], {'gold': loser['gold'] - loser_gold_loss, 'hp': loser['max_hp']})
+        if not await uow.commit():
+            yield event.plain_result("切磋途中风云突变，此战作罢，请稍后再试。")
+            return
         battle_log += f"\n战斗结束！【{winner['nickname']}】技高一筹，战胜了【{loser['nickname']}】！\n并获得了{loser_gold_loss}灵石作为战利品。"
         yield event.plain_result(battle_log)
 
+    @filter.command("切磋预测")
+    @instrumented
+    async def predict_duel(self, event: AstrMessageEvent):
+        '''按双方当前属性模拟上万次切磋，预估胜负。用法: /切磋预测 @用户'''
+        await self._wait_ready()
+        if not self._is_group_enabled(event): return
+        user_id = event.get_sender_id()
+        target_id = self._get_at_target(event)
+
+        async def predict():
+            player1 = await self._get_player(user_id, calculate_exp=False)
+            if not player1: return "你尚未踏入仙途。"
+            if not target_id:
+                return "请@你要推演的道友。"
+            if target_id == user_id:
+                return "道友，不可与自己为敌。"
+            player2 = await self._get_player(target_id, calculate_exp=False)
+            if not player2:
+                return "对方尚未踏入仙途。"
+            forecast = forecast_duel(player1, player2, self.DUEL_FORECAST_TRIALS)
+            return (f"--- 天机推演: {player1['nickname']} vs {player2['nickname']} ---\n"
+                    f"推演 {forecast.trials} 场切磋：\n"
+                    f"胜: {forecast.win:.1%}  负: {forecast.loss:.1%}\n"
+                    f"平均 {forecast.expected_turns:.1f} 回合分出结果（{MAX_TURNS}回合未分胜负时按剩余气血判定）。")
+
+        yield event.plain_result(await self.coalescer.run(("切磋预测", user_id, target_id), predict))
+
     @filter.command("储物戒")
+    @instrumented
     async def show_inventory(self, event: AstrMessageEvent):
-        '''查看你储物戒中的所有物品。'''
+        '''查看你储物戒中的物品。用法: /储物戒 [页码]'''
+        await self._wait_ready()
         if not self._is_group_enabled(event): return
+        _, page = self._parse_page(event.message_str)
+        if page is None:
+            yield event.plain_result("用法: /储物戒 [页码]")
+            event.stop_event()
+            return
         user_id = event.get_sender_id()
-        if not self._get_player(user_id):
+        if not await self._get_player(user_id):
             yield event.plain_result("你尚未踏入仙途。")
             event.stop_event()
             return
-        conn = self._get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            '''SELECT T2.name, T1.quantity, T1.is_equipped FROM inventory AS T1 JOIN items AS T2 ON T1.item_id = T2.item_id WHERE T1.user_id = ?''',
-            (user_id,))
-        items = cursor.fetchall()
-        conn.close()
+        items = await self.store.get_inventory(user_id)
         if not items:
             yield event.plain_result("你的储物戒空空如也，仿佛被洗劫过一番。")
             event.stop_event()
             return
-        msg = "--- 我的储物戒 ---\n"
-        for item in items:
+        page_count = -(-len(items) // self.INVENTORY_PAGE_SIZE)
+        if page > page_count:
+            yield event.plain_result(f"你的储物戒只有 {page_count} 页物品。")
+            event.stop_event()
+            return
+        start = (page - 1) * self.INVENTORY_PAGE_SIZE
+        lines = ["--- 我的储物戒 ---"]
+        for item in items[start:start + self.INVENTORY_PAGE_SIZE]:
             equipped_str = " (已装备)" if item['is_equipped'] else ""
-            msg += f"【{item['name']}】x {item['quantity']}{equipped_str}\n"
-        yield event.plain_result(msg)
+            lines.append(f"【{self.catalog.by_id(item['item_id']).name}】x {item['quantity']}{equipped_str}")
+        if page_count > 1:
+            lines.append(f"\n第 {page}/{page_count} 页，发送 /储物戒 [页码] 翻页。")
+        yield event.plain_result("\n".join(lines) + "\n")
         event.stop_event()
 
     @filter.command("装备")
+    @instrumented
+    @serialized()
     async def equip_item(self, event: AstrMessageEvent):
         '''装备储物戒中的一件物品。用法: /装备 [物品名称]'''
+        await self._wait_ready()
         if not self._is_group_enabled(event): return
         user_id = event.get_sender_id()
-        player = self._get_player(user_id)
+        uow = UnitOfWork(self, "equip")
+        player = await uow.player(user_id)
         if not player:
             yield event.plain_result("你尚未踏入仙途。")
             event.stop_event()
@@ -814,121 +1178,180 @@ class XiuXianPlugin(Star):
             yield event.plain_result("请指定要装备的物品名称。用法: /装备 [物品名称]")
             event.stop_event()
             return
-        conn = self._get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT item_id, type FROM items WHERE name = ?", (item_name,))
-        item_to_equip = cursor.fetchone()
+        item_to_equip = self.catalog.by_name(item_name)
         if not item_to_equip:
-            conn.close()
             yield event.plain_result(f"世间并无【{item_name}】此物。")
             event.stop_event()
             return
-        cursor.execute("SELECT id FROM inventory WHERE user_id = ? AND item_id = ?",
-                       (user_id, item_to_equip['item_id']))
-        if not cursor.fetchone():
-            conn.close()
+        if not await self.store.has_item(user_id, item_to_equip.item_id):
             yield event.plain_result("你的储物戒里没有这件东西。")
             event.stop_event()
             return
-        item_type = item_to_equip['type']
+        item_type = item_to_equip.type
         if item_type not in self.EQUIPMENT_SLOTS:
-            conn.close()
             yield event.plain_result(
             f"【{item_name}】不是一件可装备的物品。")
             event.stop_event()
             return
-        equipment = json.loads(player.get("equipment") or "{}")
-        if item_type in equipment:
-            old_item_id = equipment[item_type]
-            cursor.execute("UPDATE inventory SET is_equipped = 0 WHERE user_id = ? AND item_id = ?",
-                           (user_id, old_item_id))
-        equipment[item_type] = item_to_equip['item_id']
-        cursor.execute("UPDATE inventory SET is_equipped = 1 WHERE user_id = ? AND item_id = ?",
-                       (user_id, item_to_equip['item_id']))
-        conn.commit()
-        conn.close()
-        self._update_player(user_id, {"equipment": json.dumps(equipment)})
-        self._recalculate_stats(user_id)
+        old_item_id = await self.store.get_equipped(user_id, item_type)
+        uow.equip(user_id, item_type, item_to_equip.item_id)
+        uow.update(user_id, self._stat_updates(player, (item_delta(self.catalog.by_id(old_item_id)), -1),
+                                               (item_delta(item_to_equip), 1)))
+        if not await uow.commit():
+            yield event.plain_result("道友操作过快，请稍后再试。")
+            event.stop_event()
+            return
         yield event.plain_result(f"你已成功装备【{item_name}】。")
         event.stop_event()
 
     @filter.command("坊市")
+    @instrumented
     async def show_shop(self, event: AstrMessageEvent):
-        '''查看坊市中正在出售的商品。'''
+        '''查看坊市中正在出售的商品。用法: /坊市 [丹药|功法] [页码]'''
+        await self._wait_ready()
         if not self._is_group_enabled(event): return
-        conn = self._get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT name, description, price FROM items WHERE price > 0 ORDER BY price ASC")
-        items = cursor.fetchall()
-        conn.close()
-        msg = "--- 欢迎光临天机阁坊市 ---\n"
-        for item in items:
-            msg += f"【{item['name']}】价格: {item['price']} 灵石\n  描述: {item['description']}\n"
-        msg += "\n使用 /购买 [物品名称] 来购买。"
-        yield event.plain_result(msg)
+        category, page = self._parse_page(event.message_str)
+        if page is None or (category and category not in self.SHOP_CATEGORIES):
+            yield event.plain_result("用法: /坊市 [丹药|功法] [页码]")
+            event.stop_event()
+            return
+        pages = self._shop_page_texts(category)
+        if page > len(pages):
+            yield event.plain_result(f"坊市只有 {len(pages)} 页货品。")
+            event.stop_event()
+            return
+        yield event.plain_result(pages[page - 1])
         event.stop_event()
 
     @filter.command("购买")
+    @instrumented
+    @serialized()
     async def buy_item(self, event: AstrMessageEvent):
-        '''在坊市购买一件物品。用法: /购买 [物品名称]'''
+        '''在坊市购买物品。用法: /购买 [物品名称] [数量]'''
+        await self._wait_ready()
         if not self._is_group_enabled(event): return
         user_id = event.get_sender_id()
-        player = self._get_player(user_id)
+        uow = UnitOfWork(self, "buy")
+        player = await uow.player(user_id)
         if not player:
             yield event.plain_result("你尚未踏入仙途。")
             event.stop_event()
             return
-        item_name = event.message_str.strip()
-        if not item_name:
-            yield event.plain_result("道友想买些什么？用法: /购买 [物品名称]")
+        item_name, quantity = self._parse_quantity(event.message_str)
+        if not item_name or quantity is None:
+            yield event.plain_result("道友想买些什么？用法: /购买 [物品名称] [数量]")
             event.stop_event()
             return
-        conn = self._get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT item_id, price FROM items WHERE name = ?", (item_name,))
-        item_to_buy = cursor.fetchone()
-        if not item_to_buy or not item_to_buy['price']:
-            conn.close()
+        item_to_buy = self.catalog.by_name(item_name)
+        if not item_to_buy or not item_to_buy.price:
             yield event.plain_result("坊市中没有此物出售。")
             event.stop_event()
             return
-        if player["gold"] < item_to_buy["price"]:
-            conn.close()
-            yield event.plain_result(f"你的灵石不足！需要 {item_to_buy['price']}，你只有 {player['gold']}。")
+        total_price = item_to_buy.price * quantity
+        if player["gold"] < total_price:
+            yield event.plain_result(f"你的灵石不足！需要 {total_price}，你只有 {player['gold']}。")
+            event.stop_event()
+            return
+        uow.update(user_id, {"gold": player["gold"] - total_price})
+        uow.add_item(user_id, item_to_buy.item_id, quantity)
+        if not await uow.commit():
+            yield event.plain_result("道友操作过快，请稍后再试。")
             event.stop_event()
             return
-        new_gold = player["gold"] - item_to_buy["price"]
-        self._update_player(user_id, {"gold": new_gold})
-        cursor.execute("SELECT id, quantity FROM inventory WHERE user_id = ? AND item_id = ?",
-                       (user_id, item_to_buy['item_id']))
-        existing_item = cursor.fetchone()
-        if existing_item:
-            cursor.execute("UPDATE inventory SET quantity = ? WHERE id = ?",
-                           (existing_item['quantity'] + 1, existing_item['id']))
+        bought = f"{quantity}个【{item_name}】" if quantity > 1 else f"【{item_name}】"
+        yield event.plain_result(f"购买{bought}成功！花费了 {total_price} 灵石。")
+        event.stop_event()
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("修仙性能")
+    @instrumented
+    async def show_metrics(self, event: AstrMessageEvent):
+        '''【管理员】查看各指令的耗时分位数与数据库访问次数。'''
+        await self._wait_ready()
+        self._export_metrics()
+        uptime_hours = (time.time() - self.metrics.started_at) / 3600
+        cache = self.player_cache.stats()
+        settlement = ""
+        if self.last_settlement:
+            settled, elapsed = self.last_settlement
+            settlement = f"\n上次闭关结算: {settled} 名玩家，耗时 {elapsed * 1000:.1f} 毫秒"
+        yield event.plain_result(
+            f"--- 修仙插件性能统计（已运行 {uptime_hours:.1f} 小时）---\n{self.metrics.report()}\n"
+            f"玩家缓存: {cache['size']}/{cache['max_size']}，命中率 {cache['hit_rate']:.1%}{settlement}\n"
+            f"限流忽略: 玩家 {self.user_limiter.rejected} 次，群 {self.group_limiter.rejected} 次；"
+            f"合并重复请求 {self.coalescer.hits} 次")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("修仙备份")
+    @instrumented
+    async def backup_data(self, event: AstrMessageEvent):
+        '''【管理员】在线备份数据库。用法: /修仙备份 [导出 | 导入 文件名]'''
+        await self._wait_ready()
+        args = event.message_str.split()
+        action = args[0] if args else ""
+        if not action:
+            archive, removed = await self._create_backup()
+            yield event.plain_result(f"备份完成：{archive.name}（{archive.stat().st_size / 1024:.0f} KB），"
+                                     f"已清理旧备份 {removed} 份。")
+        elif action == "导出":
+            path, counts = await self._export_snapshot()
+            summary = "，".join(f"{table} {count} 行" for table, count in counts.items())
+            yield event.plain_result(f"导出完成：{path.name}\n{summary}")
+        elif action == "导入" and len(args) == 2:
+            # 只接受备份目录中的文件名
+            path = self.backup_dir / Path(args[1]).name
+            if not path.is_file():
+                yield event.plain_result(f"备份目录中没有文件 {path.name}。")
+                event.stop_event()
+                return
+            counts = await self._import_snapshot(path)
+            summary = "，".join(f"{table} {count} 行" for table, count in counts.items())
+            yield event.plain_result(f"导入完成：{summary}\n玩家缓存与排行榜已重新载入。")
+        else:
+            yield event.plain_result("用法: /修仙备份 [导出 | 导入 文件名]")
+        event.stop_event()
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("修仙账本")
+    @instrumented
+    async def audit_economy(self, event: AstrMessageEvent):
+        '''【管理员】按流水核对灵石与物品，或压缩旧流水。用法: /修仙账本 [核对 [@用户] | 压缩]'''
+        await self._wait_ready()
+        action = event.message_str.split()[0] if event.message_str.split() else "核对"
+        if action == "压缩":
+            folded = await self._compact_journal()
+            yield event.plain_result(f"已把 {self.journal_retention_days} 天前的 {folded} 条流水折叠进余额快照。")
+        elif action == "核对":
+            target_id = self._get_at_target(event)
+            await self._flush_player_cache()
+            mismatches = await self.store.audit_economy(target_id)
+            if not mismatches:
+                yield event.plain_result("账目核对无误，流水与实际余额一致。")
+            else:
+                lines = [f"共 {len(mismatches)} 名道友的账目与流水不符:"]
+                for uid, expected, actual in mismatches[:10]:
+                    lines.append(f"{uid}: 流水灵石 {expected['gold']} / 实际 {actual['gold']}"
+                                 + ("，物品不一致" if expected['items'] != actual['items'] else ""))
+                yield event.plain_result("\n".join(lines))
         else:
-            cursor.execute("INSERT INTO inventory (user_id, item_id, quantity) VALUES (?, ?, ?)",
-                           (user_id, item_to_buy['item_id'], 1))
-        conn.commit()
-        conn.close()
-        yield event.plain_result(f"购买【{item_name}】成功！花费了 {item_to_buy['price']} 灵石。")
+            yield event.plain_result("用法: /修仙账本 [核对 [@用户] | 压缩]")
         event.stop_event()
 
     @filter.command("重置修仙数据")
+    @instrumented
+    @serialized()
     async def reset_data(self, event: AstrMessageEvent):
         '''【高危】删除你的所有修仙数据，重入轮回。每位玩家每日仅限一次。'''
+        await self._wait_ready()
         if not self._is_group_enabled(event): return
 
         user_id = event.get_sender_id()
-        if not self._get_player(user_id, calculate_exp=False):
+        if not await self._get_player(user_id, calculate_exp=False):
             yield event.plain_result("未找到你的修仙数据。")
             return
 
         today = datetime.now().strftime("%Y-%m-%d")
-        conn = self._get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM reset_logs WHERE user_id = ? AND reset_date = ?", (user_id, today))
-        already_reset = cursor.fetchone()
-        conn.close()
+        already_reset = await self.store.has_reset_on(user_id, today)
 
         if already_reset:
             yield event.plain_result("道友，天命不可常改，每日仅有一次重入轮回之机。请明日再来吧。")
@@ -936,16 +1359,11 @@ class XiuXianPlugin(Star):
 
         confirm_key = f"xiuxian_reset_confirm_{user_id}"
         if self.context.get(confirm_key):
-            # 再次确认可以重置
-            conn = self._get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM players WHERE user_id = ?", (user_id,))
-            cursor.execute("DELETE FROM inventory WHERE user_id = ?", (user_id,))
-            cursor.execute("DELETE FROM sects WHERE leader_id = ?", (user_id,))
-            cursor.execute("INSERT INTO reset_logs (user_id, reset_date) VALUES (?, ?)", (user_id, today))
-
-            conn.commit()
-            conn.close()
+            # 再次确认可以重置；尚未入库的流水随缓存一起作废，重置本身由存储层记一条流水
+            self.journal.discard(user_id)
+            await self.store.reset_player(user_id, today)
+            self.player_cache.discard(user_id)
+            self.leaderboards.remove(user_id)
             self.context.delete(confirm_key)
             yield event.plain_result("你的所有尘缘已了，重入轮回。")
         else:
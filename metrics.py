@@ -0,0 +1,168 @@
+import bisect
+import contextvars
+import functools
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# 延迟直方图的桶上界（秒）：从 0.05ms 起按 1.25 倍递增到约 60s，分位数误差在一个桶宽之内
+LATENCY_BUCKETS = tuple(0.00005 * 1.25 ** k for k in range(64))
+
+_current_call = contextvars.ContextVar("xiuxian_current_call", default=None)
+
+
+class _CallCounters:
+    '''一次指令调用期间的 SQL 计数。通过 contextvars 随调用传递，DatabaseExecutor 会把上下文带进数据库线程。'''
+    __slots__ = ("statements", "commits")
+
+    def __init__(self):
+        self.statements = 0
+        self.commits = 0
+
+
+def count_statement(statement: str = None):
+    '''sqlite3 的 trace callback：每执行一条语句调用一次。'''
+    counters = _current_call.get()
+    if counters is not None:
+        counters.statements += 1
+
+
+def count_commit():
+    counters = _current_call.get()
+    if counters is not None:
+        counters.commits += 1
+
+
+class CommandStats:
+    __slots__ = ("calls", "errors", "total_seconds", "statements", "commits", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.statements = 0
+        self.commits = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, seconds: float, counters: _CallCounters, failed: bool):
+        self.calls += 1
+        self.errors += failed
+        self.total_seconds += seconds
+        self.statements += counters.statements
+        self.commits += counters.commits
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def percentile(self, q: float) -> float:
+        '''按直方图估算分位数（秒），在命中的桶内线性插值。'''
+        if not self.calls:
+            return 0.0
+        target = q * self.calls
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            if count and seen + count >= target:
+                lower = LATENCY_BUCKETS[index - 1] if index else 0.0
+                upper = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else lower * 1.25
+                return lower + (upper - lower) * (target - seen) / count
+            seen += count
+        return LATENCY_BUCKETS[-1]
+
+
+class MetricsRegistry:
+    '''按指令汇总的延迟直方图、调用与错误次数、SQL 语句与提交次数。'''
+
+    def __init__(self):
+        self.commands = {}
+        self.started_at = time.time()
+
+    @contextmanager
+    def track(self, name: str):
+        '''统计一段非指令的后台工作，例如定期写回缓存。'''
+        counters = _CallCounters()
+        token = _current_call.set(counters)
+        started = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            _current_call.reset(token)
+            self._stats(name).record(time.perf_counter() - started, counters, failed)
+
+    def _stats(self, name: str) -> CommandStats:
+        stats = self.commands.get(name)
+        if stats is None:
+            stats = self.commands[name] = CommandStats()
+        return stats
+
+    def report(self) -> str:
+        lines = ["指令 | 次数 | 错误 | p50/p95/p99 (ms) | SQL/次 | 提交/次"]
+        for name, stats in sorted(self.commands.items(), key=lambda item: -item[1].calls):
+            p50, p95, p99 = (stats.percentile(q) * 1000 for q in (0.5, 0.95, 0.99))
+            lines.append(f"{name} | {stats.calls} | {stats.errors} | {p50:.1f}/{p95:.1f}/{p99:.1f} | "
+                         f"{stats.statements / stats.calls:.1f} | {stats.commits / stats.calls:.2f}")
+        return "\n".join(lines)
+
+    def prometheus_text(self) -> str:
+        out = ["# HELP xiuxian_command_latency_seconds 指令处理耗时（不含消息发送）",
+               "# TYPE xiuxian_command_latency_seconds histogram"]
+        for name, stats in self.commands.items():
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                cumulative += count
+                out.append(f'xiuxian_command_latency_seconds_bucket{{command="{name}",le="{bound:.6g}"}} {cumulative}')
+            out.append(f'xiuxian_command_latency_seconds_bucket{{command="{name}",le="+Inf"}} {stats.calls}')
+            out.append(f'xiuxian_command_latency_seconds_sum{{command="{name}"}} {stats.total_seconds:.6f}')
+            out.append(f'xiuxian_command_latency_seconds_count{{command="{name}"}} {stats.calls}')
+        for metric, attr, help_text in (("xiuxian_command_errors_total", "errors", "指令抛出异常的次数"),
+                                        ("xiuxian_sql_statements_total", "statements", "指令执行的 SQL 语句数"),
+                                        ("xiuxian_sql_commits_total", "commits", "指令提交的事务数")):
+            out.append(f"# HELP {metric} {help_text}")
+            out.append(f"# TYPE {metric} counter")
+            for name, stats in self.commands.items():
+                out.append(f'{metric}{{command="{name}"}} {getattr(stats, attr)}')
+        return "\n".join(out) + "\n"
+
+    def write_prometheus(self, path: Path):
+        # 先写临时文件再替换，采集端不会读到半个文件
+        tmp = Path(f"{path}.tmp")
+        tmp.write_text(self.prometheus_text(), encoding="utf-8")
+        os.replace(tmp, path)
+
+
+def instrumented(handler):
+    '''包装指令处理函数（异步生成器），记录耗时与 SQL 次数。
+
+    只计入处理函数自身运行的时间，yield 出去等待框架发送消息的时间不计；
+    计数上下文只在处理函数运行期间生效，不会泄漏给框架。
+    '''
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(self, *args, **kwargs):
+        counters = _CallCounters()
+        elapsed = 0.0
+        failed = False
+        results = handler(self, *args, **kwargs)
+        try:
+            while True:
+                token = _current_call.set(counters)
+                started = time.perf_counter()
+                try:
+                    result = await results.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - started
+                    _current_call.reset(token)
+                yield result
+        except Exception:
+            failed = True
+            raise
+        finally:
+            await results.aclose()
+            self.metrics._stats(name).record(elapsed, counters, failed)
+
+    return wrapper
@@ -0,0 +1,193 @@
+import json
+from astrbot.api import logger
+from .journal import rebase
+from .stats import BONUS_FIELDS
+
+# 数据库结构版本记录在 PRAGMA user_version 中。每个步骤只在版本号低于它时执行一次，
+# 且自身保持幂等：user_version 为 0 的旧库已经做过其中一部分，重新执行也不会出错。
+# 新增步骤时追加到 MIGRATIONS 末尾，不要修改已发布的步骤。
+# 步骤签名为 step(cursor, initial_items)。
+
+PLAYERS_TABLE = '''CREATE TABLE IF NOT EXISTS players (user_id TEXT PRIMARY KEY, nickname TEXT, major_level INTEGER DEFAULT 0, minor_level INTEGER DEFAULT 1, exp INTEGER DEFAULT 0, gold INTEGER DEFAULT 0, spirit_root TEXT, is_seclusion BOOLEAN DEFAULT 0, seclusion_start_time REAL DEFAULT 0, hp INTEGER DEFAULT 100, max_hp INTEGER DEFAULT 100, attack INTEGER DEFAULT 10, defense INTEGER DEFAULT 5, sect_id INTEGER, sect_role TEXT, equipment TEXT, skills TEXT, last_checkin_date TEXT, created_at TEXT)'''
+
+
+def _create_base_tables(cursor, initial_items):
+    cursor.execute("PRAGMA table_info(players)")
+    columns = [col['name'] for col in cursor.fetchall()]
+    if 'level' in columns:
+        logger.info("检测到旧版玩家表，正在升级...")
+        cursor.execute("ALTER TABLE players RENAME TO players_old")
+        cursor.execute(PLAYERS_TABLE)
+        cursor.execute(
+            "INSERT INTO players (user_id, nickname, major_level, exp, gold, spirit_root, is_seclusion, seclusion_start_time, hp, max_hp, attack, defense, sect_id, sect_role, equipment, skills, last_checkin_date, created_at) SELECT user_id, nickname, level, exp, gold, spirit_root, is_seclusion, seclusion_start_time, hp, max_hp, attack, defense, sect_id, sect_role, equipment, skills, last_checkin_date, created_at FROM players_old")
+        cursor.execute("DROP TABLE players_old")
+        logger.info("玩家表结构升级完成。")
+    else:
+        cursor.execute(PLAYERS_TABLE)
+
+    cursor.execute(
+        '''CREATE TABLE IF NOT EXISTS items (item_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE, type TEXT, description TEXT, price INTEGER, data TEXT)''')
+    cursor.execute(
+        '''CREATE TABLE IF NOT EXISTS inventory (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, item_id INTEGER, quantity INTEGER, is_equipped BOOLEAN DEFAULT 0, FOREIGN KEY (user_id) REFERENCES players (user_id), FOREIGN KEY (item_id) REFERENCES items (item_id))''')
+    cursor.execute(
+        '''CREATE TABLE IF NOT EXISTS sects (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE, leader_id TEXT, announcement TEXT, level INTEGER DEFAULT 1, resources INTEGER DEFAULT 0, created_at TEXT)''')
+    # 重置日志表，用于记录每日重置次数
+    cursor.execute('''CREATE TABLE IF NOT EXISTS reset_logs (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, reset_date TEXT)''')
+
+
+def _seed_items(cursor, initial_items):
+    cursor.execute("SELECT COUNT(*) FROM items")
+    if cursor.fetchone()['COUNT(*)'] > 10:
+        return
+    cursor.execute("DELETE FROM items")
+    cursor.executemany("INSERT INTO items (name, type, description, price, data) VALUES (?, ?, ?, ?, ?)", initial_items)
+    logger.info(f"数据库已填充 {len(initial_items)} 种初始物品。")
+
+
+def _unique_inventory(cursor, initial_items):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_inventory_user_item'")
+    if cursor.fetchone():
+        return
+    # 旧版本的“先查后写”在并发下可能为同一物品产生多行，先合并到 id 最小的那一行再加唯一约束
+    cursor.execute(
+        '''UPDATE inventory SET quantity = (SELECT SUM(d.quantity) FROM inventory AS d WHERE d.user_id = inventory.user_id AND d.item_id = inventory.item_id), is_equipped = (SELECT MAX(d.is_equipped) FROM inventory AS d WHERE d.user_id = inventory.user_id AND d.item_id = inventory.item_id) WHERE id IN (SELECT MIN(id) FROM inventory GROUP BY user_id, item_id HAVING COUNT(*) > 1)''')
+    cursor.execute("DELETE FROM inventory WHERE id NOT IN (SELECT MIN(id) FROM inventory GROUP BY user_id, item_id)")
+    if cursor.rowcount:
+        logger.info(f"已合并 {cursor.rowcount} 条重复的储物戒记录。")
+    cursor.execute("CREATE UNIQUE INDEX idx_inventory_user_item ON inventory (user_id, item_id)")
+
+
+def _ranking_indexes(cursor, initial_items):
+    # 排行榜按各自的排序键走覆盖索引，无需全表排序；重置日志按 (user_id, reset_date) 查询
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_players_exp ON players (exp DESC, nickname)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_players_gold ON players (gold DESC, nickname)")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_players_realm ON players (major_level DESC, minor_level DESC, exp DESC, nickname)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reset_logs_user_date ON reset_logs (user_id, reset_date)")
+
+
+def _player_bonus_columns(cursor, initial_items):
+    # 被动加成缓存列不设默认值：旧玩家保持 NULL，首次读入时由插件全量计算补齐
+    cursor.execute("PRAGMA table_info(players)")
+    columns = {col['name'] for col in cursor.fetchall()}
+    for field in BONUS_FIELDS:
+        if field not in columns:
+            column_type = "INTEGER" if field.startswith("flat_") else "REAL"
+            cursor.execute(f"ALTER TABLE players ADD COLUMN {field} {column_type}")
+
+
+def _seclusion_index(cursor, initial_items):
+    # 闭关结算只扫描闭关中的玩家
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_players_seclusion ON players (seclusion_start_time) WHERE is_seclusion = 1")
+
+
+def _group_members(cursor, initial_items):
+    # 群成员索引：按群取成员走主键，重置玩家时按 user_id 删除走二级索引
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS group_members (group_id TEXT NOT NULL, user_id TEXT NOT NULL, PRIMARY KEY (group_id, user_id)) WITHOUT ROWID")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_group_members_user ON group_members (user_id)")
+
+
+def _economy_journal(cursor, initial_items):
+    # 只追加的经济流水与每名玩家的余额快照；已有玩家以建表时的余额作为快照起点
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS economy_journal (id INTEGER PRIMARY KEY, ts INTEGER NOT NULL, user_id TEXT NOT NULL, kind TEXT NOT NULL, gold INTEGER NOT NULL DEFAULT 0, item_id INTEGER, quantity INTEGER NOT NULL DEFAULT 0)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_economy_journal_user ON economy_journal (user_id, id)")
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS economy_checkpoints (user_id TEXT PRIMARY KEY, gold INTEGER NOT NULL, items TEXT NOT NULL, through_id INTEGER NOT NULL, ts INTEGER)")
+    rebase(cursor)
+
+
+def _player_version(cursor, initial_items):
+    # 乐观并发控制用的版本号，每次工作单元提交时加一
+    cursor.execute("PRAGMA table_info(players)")
+    if "version" not in {col['name'] for col in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE players ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+
+def _seclusion_session_columns(cursor, initial_items):
+    # 定期结算会推进 seclusion_start_time，整次闭关的起点与其间已结算的修为另行记录，供出关时汇报
+    cursor.execute("PRAGMA table_info(players)")
+    columns = {col['name'] for col in cursor.fetchall()}
+    if "seclusion_session_start" not in columns:
+        cursor.execute("ALTER TABLE players ADD COLUMN seclusion_session_start REAL")
+        cursor.execute("UPDATE players SET seclusion_session_start = seclusion_start_time WHERE is_seclusion = 1")
+    if "seclusion_banked_exp" not in columns:
+        cursor.execute("ALTER TABLE players ADD COLUMN seclusion_banked_exp INTEGER NOT NULL DEFAULT 0")
+
+
+def split_loadout(cursor) -> int:
+    '''把 players.skills / players.equipment 中的 JSON 拆进 player_skills / player_equipment 并清空原列。
+
+    迁移时执行一次；导入旧版本导出的文件后也要再执行一次。返回处理的玩家数。
+    '''
+    cursor.execute("SELECT user_id, skills, equipment FROM players WHERE skills IS NOT NULL OR equipment IS NOT NULL")
+    players = cursor.fetchall()
+    skill_rows, equipment_rows = [], []
+    for row in players:
+        for skill_name, data in json.loads(row['skills'] or "{}").items():
+            skill_rows.append((row['user_id'], skill_name, json.dumps(data, ensure_ascii=False)))
+        for slot, item_id in json.loads(row['equipment'] or "{}").items():
+            if item_id is not None:
+                equipment_rows.append((row['user_id'], slot, item_id))
+    cursor.executemany("INSERT OR REPLACE INTO player_skills (user_id, skill_name, data) VALUES (?, ?, ?)", skill_rows)
+    cursor.executemany("INSERT OR REPLACE INTO player_equipment (user_id, slot, item_id) VALUES (?, ?, ?)",
+                       equipment_rows)
+    cursor.execute("UPDATE players SET skills = NULL, equipment = NULL WHERE skills IS NOT NULL OR equipment IS NOT NULL")
+    return len(players)
+
+
+def _loadout_tables(cursor, initial_items):
+    # 功法与装备各占一行，按主键 (user_id, 功法名/部位) 读写；players 中的 JSON 列与 inventory.is_equipped 不再使用
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS player_skills (user_id TEXT NOT NULL, skill_name TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (user_id, skill_name))")
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS player_equipment (user_id TEXT NOT NULL, slot TEXT NOT NULL, item_id INTEGER NOT NULL, PRIMARY KEY (user_id, slot))")
+    converted = split_loadout(cursor)
+    if converted:
+        logger.info(f"已把 {converted} 名玩家的功法与装备迁入独立的表。")
+
+
+def _drop_ranking_indexes(cursor, initial_items):
+    # 排行榜改由内存中的 LeaderboardService 提供，不再有按修为、灵石、境界排序的查询，
+    # 第 4 步建的这三个索引只会拖慢每次修为与灵石的写入（包括闭关批量结算），新库同样在此删除
+    for index in ("idx_players_exp", "idx_players_gold", "idx_players_realm"):
+        cursor.execute(f"DROP INDEX IF EXISTS {index}")
+
+
+MIGRATIONS = (
+    (1, "创建基础表", _create_base_tables),
+    (2, "填充初始物品", _seed_items),
+    (3, "储物戒唯一约束", _unique_inventory),
+    (4, "排行榜与重置日志索引", _ranking_indexes),
+    (5, "被动加成缓存列", _player_bonus_columns),
+    (6, "闭关玩家索引", _seclusion_index),
+    (7, "群成员表", _group_members),
+    (8, "经济流水", _economy_journal),
+    (9, "玩家版本号", _player_version),
+    (10, "功法与装备拆表", _loadout_tables),
+    (11, "删除排行榜排序索引", _drop_ranking_indexes),
+    (12, "闭关会话记录", _seclusion_session_columns),
+)
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(db, initial_items) -> int:
+    '''把数据库升级到最新版本，返回升级前的版本号。已是最新时只读取一次 user_version。'''
+    with db.reader() as cursor:
+        cursor.execute("PRAGMA user_version")
+        current = cursor.fetchone()['user_version']
+    if current >= LATEST_VERSION:
+        return current
+    with db.writer() as cursor:
+        # 拿到写锁后重新确认，避免与另一个进程重复迁移
+        cursor.execute("PRAGMA user_version")
+        current = cursor.fetchone()['user_version']
+        for version, description, step in MIGRATIONS:
+            if version > current:
+                logger.info(f"正在执行数据库迁移 {version}: {description}")
+                step(cursor, initial_items)
+        cursor.execute(f"PRAGMA user_version = {LATEST_VERSION}")
+    logger.info(f"数据库已从版本 {current} 升级到 {LATEST_VERSION}。")
+    return current
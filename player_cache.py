@@ -0,0 +1,162 @@
+from collections import OrderedDict
+
+
+class PlayerCache:
+    '''按 user_id 缓存玩家记录的有界 LRU 写回缓存。
+
+    读操作直接命中内存；写操作只修改缓存中的记录并记下脏字段，由插件定期
+    （以及淘汰、卸载时）调用 take_dirty() 取出后在一个事务里批量写回。
+    '''
+
+    def __init__(self, max_size: int = 5000):
+        self.max_size = max(1, max_size)
+        self._records = OrderedDict()
+        self._dirty = {}
+        # 已被淘汰但尚未落盘的脏字段 {user_id: {字段: 值}}；该玩家再次被读入时会覆盖到新记录上，
+        # 避免读到数据库里的旧值
+        self._pending = {}
+        # 已经取出、正在写库的字段；写库完成前读入的记录同样要覆盖这些值
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        # 每次 clear() 加一；读库期间发生过 clear() 时，读到的行不能再放入缓存
+        self.generation = 0
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, user_id):
+        return user_id in self._records
+
+    def get(self, user_id: str):
+        record = self._records.get(user_id)
+        if record is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._records.move_to_end(user_id)
+        return record.copy()
+
+    def peek(self, user_id: str, field: str):
+        '''读取缓存中（含已淘汰未落盘的）某个字段的当前值，不影响 LRU 顺序与命中统计；没有时返回 None。'''
+        pending = self._pending.get(user_id)
+        if pending and field in pending:
+            return pending[field]
+        record = self._records.get(user_id)
+        return record.get(field) if record is not None else None
+
+    def put(self, user_id: str, record: dict) -> dict:
+        '''放入一条从数据库读出的干净记录（records.Player）并返回其副本，必要时淘汰最久未使用的记录。
+
+        两次未命中的读取交错时，先放入的记录可能已被修改，此时保留缓存中的记录，丢弃较旧的数据库行。
+        '''
+        existing = self._records.get(user_id)
+        if existing is not None:
+            self._records.move_to_end(user_id)
+            return existing.copy()
+        record = record.copy()
+        unsaved = {**self._inflight.get(user_id, {}), **self._pending.pop(user_id, {})}
+        if unsaved:
+            record.update(unsaved)
+            self._dirty.setdefault(user_id, set()).update(unsaved.keys())
+        self._records[user_id] = record
+        self._records.move_to_end(user_id)
+        while len(self._records) > self.max_size:
+            old_id, old_record = self._records.popitem(last=False)
+            fields = self._dirty.pop(old_id, None)
+            if fields:
+                self._pending[old_id] = {field: old_record[field] for field in fields}
+        return record.copy()
+
+    def update(self, user_id: str, data: dict) -> bool:
+        '''修改缓存中的记录并标记脏字段；记录不在缓存中时返回 False，由调用方直接写库。'''
+        record = self._records.get(user_id)
+        if record is None:
+            if user_id in self._pending:
+                self._pending[user_id].update(data)
+                return True
+            return False
+        record.update(data)
+        self._dirty.setdefault(user_id, set()).update(data.keys())
+        return True
+
+    def apply_persisted(self, user_id: str, data: dict):
+        '''同步已经直接写入数据库的字段，这些字段不再视为脏数据。'''
+        pending = self._pending.get(user_id)
+        if pending:
+            for field in data:
+                pending.pop(field, None)
+        record = self._records.get(user_id)
+        if record is None:
+            return
+        record.update(data)
+        fields = self._dirty.get(user_id)
+        if fields:
+            fields.difference_update(data.keys())
+
+    def apply_settled(self, user_id: str, data: dict) -> bool:
+        '''同步后台结算写入数据库的字段。结算期间这些字段又在内存中被改过时保留内存中的新值，返回 False。'''
+        dirty = self._dirty.get(user_id, set()) | self._pending.get(user_id, {}).keys()
+        if not dirty.isdisjoint(data):
+            return False
+        record = self._records.get(user_id)
+        if record is not None:
+            record.update(data)
+        return True
+
+    def clear(self):
+        '''丢弃全部记录与未写回的修改，用于整库导入之后。'''
+        self._records.clear()
+        self._dirty.clear()
+        self._pending.clear()
+        self._inflight = {}
+        self.generation += 1
+
+    def discard(self, user_id: str):
+        '''丢弃记录及其脏数据，用于数据库中的行已被删除的情况。'''
+        self._records.pop(user_id, None)
+        self._dirty.pop(user_id, None)
+        self._pending.pop(user_id, None)
+        self._inflight.pop(user_id, None)
+
+    @property
+    def has_dirty(self) -> bool:
+        return bool(self._pending) or any(self._dirty.values())
+
+    @property
+    def has_evicted(self) -> bool:
+        return bool(self._pending)
+
+    def take_dirty(self, evicted_only: bool = False) -> dict:
+        '''取出待写回的字段，返回 {user_id: {字段: 值}}，并清空脏标记。
+
+        evicted_only 为 True 时只取已被淘汰的记录。写库结束后必须调用 flush_done() 或 restore_dirty()。
+        '''
+        batch = {user_id: data for user_id, data in self._pending.items() if data}
+        self._pending.clear()
+        if not evicted_only:
+            for user_id, fields in self._dirty.items():
+                if fields:
+                    record = self._records[user_id]
+                    batch[user_id] = {field: record[field] for field in fields}
+            self._dirty.clear()
+        self._inflight = batch
+        return batch
+
+    def flush_done(self):
+        self._inflight = {}
+
+    def restore_dirty(self, batch: dict):
+        '''写回失败时重新标记脏字段，等待下一次落盘。'''
+        self._inflight = {}
+        for user_id, data in batch.items():
+            if user_id in self._records:
+                self._dirty.setdefault(user_id, set()).update(data.keys())
+            else:
+                # 写回期间又有新值进入 pending 时以新值为准
+                self._pending[user_id] = {**data, **self._pending.get(user_id, {})}
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self._records), "max_size": self.max_size, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0}
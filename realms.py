@@ -0,0 +1,62 @@
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional
+
+
+class RealmStage(NamedTuple):
+    major_level: int
+    minor_level: int
+    major_name: str
+    minor_name: str
+    full_name: str
+    max_minor_level: int
+    exp_needed: int
+    success_rate: float
+    base_stats: Mapping[str, int]
+
+
+def _build_stage(realm_config, major_level: int, minor_level: int) -> RealmStage:
+    realm = realm_config[major_level]
+    name = realm['name']
+    display = realm['display'](minor_level)
+    exp_needed = int(realm['exp_base'] * (minor_level ** 1.5) * (major_level * 1.2 + 1))
+    base_stats = MappingProxyType({"attack": 10 + major_level * 10 + minor_level * 2,
+                                   "defense": 5 + major_level * 8 + minor_level,
+                                   "max_hp": 100 + major_level * 100 + minor_level * 10})
+    return RealmStage(major_level, minor_level, name, display, f"{name}·{display}", realm['levels'],
+                      exp_needed, 0.8 - major_level * 0.05 - minor_level * 0.01, base_stats)
+
+
+class RealmLadder:
+    '''把 REALM_CONFIG 展开成从炼气期第1层到真仙的完整阶梯。
+
+    每个 (大境界, 小境界) 的名称、突破所需修为、基础成功率与基础属性在载入时一次算好，
+    之后查询只是一次字典查找。
+    '''
+
+    def __init__(self, realm_config):
+        self._config = realm_config
+        stages = []
+        for major_level, realm in enumerate(realm_config):
+            for minor_level in range(1, realm['levels'] + 1):
+                stages.append(_build_stage(realm_config, major_level, minor_level))
+        self.stages = tuple(stages)
+        self._by_level = {(stage.major_level, stage.minor_level): stage for stage in stages}
+
+    def __len__(self):
+        return len(self.stages)
+
+    def stage(self, major_level: int, minor_level: int) -> RealmStage:
+        major_level = min(major_level, len(self._config) - 1)
+        stage = self._by_level.get((major_level, minor_level))
+        if stage is None:
+            # 不在阶梯上的组合（如手工改过的数据）按原公式现算
+            stage = _build_stage(self._config, major_level, minor_level)
+        return stage
+
+    def next_stage(self, stage: RealmStage) -> Optional[RealmStage]:
+        '''突破成功后到达的阶段，已是最后一个大境界的顶层时返回 None。'''
+        if stage.minor_level < stage.max_minor_level:
+            return self.stage(stage.major_level, stage.minor_level + 1)
+        if stage.major_level + 1 < len(self._config):
+            return self.stage(stage.major_level + 1, 1)
+        return None
@@ -0,0 +1,126 @@
+from .stats import BONUS_FIELDS
+
+
+class Record:
+    '''__slots__ 记录的基类，由 SQLite 的元组行直接构造。
+
+    同时支持 record.exp 与 record["exp"]、record.get("exp")、update()、keys() 等字典式用法，
+    原先按字典编写的代码无需修改。子类只需声明 FIELDS，槽位与按位置赋值的 __init__ 自动生成。
+    '''
+    __slots__ = ()
+    FIELDS = ()
+    _field_set = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        fields = cls.__dict__.get("FIELDS", ())
+        cls._field_set = frozenset(fields)
+        # 与 namedtuple 相同的做法：生成逐个赋值的构造函数，比循环 setattr 快得多
+        args = ", ".join(fields)
+        body = "".join(f"\n    self.{name} = {name}" for name in fields) or "\n    pass"
+        namespace = {}
+        exec(f"def __init__(self, {args}):{body}", namespace)
+        cls.__init__ = namespace["__init__"]
+        exec(f"def copy(self):\n    return _cls({', '.join(f'self.{name}' for name in fields)})",
+             {"_cls": cls}, namespace)
+        cls.copy = namespace["copy"]
+
+    def __getitem__(self, key):
+        if key not in self._field_set:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._field_set:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._field_set
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return type(self) is type(other) and all(self[name] == other[name] for name in self.FIELDS)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{name}={self[name]!r}' for name in self.FIELDS)})"
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self._field_set else default
+
+    def keys(self):
+        return self.FIELDS
+
+    def values(self):
+        return [getattr(self, name) for name in self.FIELDS]
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self.FIELDS]
+
+    def update(self, data: dict):
+        for key, value in data.items():
+            self[key] = value
+
+    def to_dict(self) -> dict:
+        return dict(self.items())
+
+
+class Player(Record):
+    '''players 表的一行。players 中已弃用的 skills / equipment 列不在其中。'''
+    FIELDS = ("user_id", "nickname", "major_level", "minor_level", "exp", "gold", "spirit_root", "is_seclusion",
+              "seclusion_start_time", "seclusion_session_start", "seclusion_banked_exp", "hp", "max_hp", "attack", "defense", "sect_id", "sect_role",
+              "last_checkin_date", "created_at", *BONUS_FIELDS, "version")
+    __slots__ = FIELDS
+
+
+class Profile(Record):
+    '''排行榜常驻内存的玩家资料。'''
+    FIELDS = ("user_id", "nickname", "exp", "gold", "major_level", "minor_level")
+    __slots__ = FIELDS
+
+
+class InventoryRow(Record):
+    FIELDS = ("item_id", "quantity", "is_equipped")
+    __slots__ = FIELDS
+
+
+class ItemRow(Record):
+    FIELDS = ("item_id", "name", "type", "description", "price", "data")
+    __slots__ = FIELDS
+
+
+def columns(cls) -> str:
+    '''SELECT 用的列清单，顺序与 FIELDS 一致。'''
+    return ", ".join(cls.FIELDS)
+
+
+def fetch_records(cursor, cls, sql: str, params=()) -> list:
+    '''执行查询并把元组行构造成 cls 的记录。
+
+    列的位置按 cursor.description 每条语句解析一次：列清单与 FIELDS 一致时按位置直接构造，
+    否则（如 SELECT * 带有多余的列）先算出各字段所在的下标，结果中缺少的字段为 None。
+    '''
+    row_factory, cursor.row_factory = cursor.row_factory, None
+    try:
+        cursor.execute(sql, params)
+        names = tuple(col[0] for col in cursor.description)
+        if names == cls.FIELDS:
+            return [cls(*row) for row in cursor]
+        positions = [names.index(name) if name in names else None for name in cls.FIELDS]
+        return [cls(*(None if i is None else row[i] for i in positions)) for row in cursor]
+    finally:
+        cursor.row_factory = row_factory
+
+
+def fetch_record(cursor, cls, sql: str, params=()):
+    rows = fetch_records(cursor, cls, sql, params)
+    return rows[0] if rows else None
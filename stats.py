@@ -0,0 +1,63 @@
+STATS = ("attack", "defense", "max_hp")
+
+# 玩家表中缓存的被动加成列：flat_* 为固定加值（功法 + 装备），pct_* 与 exp_rate 为倍率（从 1.0 起累加）。
+# 列值为 NULL 表示该玩家尚未建立缓存，读入时做一次全量计算补齐
+BONUS_FIELDS = tuple(f"flat_{stat}" for stat in STATS) + tuple(f"pct_{stat}" for stat in STATS) + ("exp_rate",)
+
+
+def empty_bonus() -> dict:
+    bonus = {f"flat_{stat}": 0 for stat in STATS}
+    bonus.update({f"pct_{stat}": 1.0 for stat in STATS})
+    bonus["exp_rate"] = 1.0
+    return bonus
+
+
+def skill_delta(skill_data: dict) -> dict:
+    '''一门功法带来的加成增量，非被动或无属性效果的功法返回空字典。'''
+    if skill_data.get('type') != 'passive':
+        return {}
+    effect = skill_data.get('effect')
+    if effect == 'exp_rate':
+        return {"exp_rate": skill_data.get('value', 0)}
+    if effect == 'add_flat_stat':
+        return {f"flat_{stat}": value for stat, value in skill_data['value'].items() if stat in STATS}
+    if effect == 'add_percent_stat':
+        return {f"pct_{stat}": value for stat, value in skill_data['value'].items() if stat in STATS}
+    return {}
+
+
+def item_delta(item) -> dict:
+    '''一件装备带来的固定加值增量。物品数据里气血加成的键为 hp。'''
+    if item is None:
+        return {}
+    params = item.effect.params
+    delta = {"flat_attack": params.get('attack', 0), "flat_defense": params.get('defense', 0),
+             "flat_max_hp": params.get('hp', 0)}
+    return {field: value for field, value in delta.items() if value}
+
+
+def apply_delta(bonus: dict, delta: dict, sign: int = 1) -> dict:
+    '''返回叠加 delta 后发生变化的加成字段，sign=-1 表示撤销。'''
+    return {field: bonus[field] + sign * value for field, value in delta.items()}
+
+
+def full_bonus(skills: dict, equipment: dict, catalog) -> dict:
+    '''按功法与装备全量计算加成，用于补齐旧数据和一致性校验。'''
+    bonus = empty_bonus()
+    for item_id in equipment.values():
+        bonus.update(apply_delta(bonus, item_delta(catalog.by_id(item_id))))
+    for skill_data in skills.values():
+        bonus.update(apply_delta(bonus, skill_delta(skill_data)))
+    return bonus
+
+
+def player_bonus(player: dict) -> dict:
+    '''玩家记录中缓存的加成。尚无缓存列的旧记录由读入时按功法与装备全量计算补齐。'''
+    return {field: player[field] for field in BONUS_FIELDS}
+
+
+def derive_stats(base_stats, hp: int, bonus: dict) -> dict:
+    '''由境界基础属性与已汇总的加成得出攻防血，只做算术，不再解析功法与装备。'''
+    stats = {stat: int((base_stats[stat] + bonus[f"flat_{stat}"]) * bonus[f"pct_{stat}"]) for stat in STATS}
+    stats["hp"] = min(hp, stats["max_hp"])
+    return stats
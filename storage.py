@@ -0,0 +1,407 @@
+import json
+import sqlite3
+from .backup import EXPORT_TABLES, IMPORT_BATCH_SIZE, IMPORT_SKIP_COLUMNS, read_jsonl, write_jsonl
+from .db import ConnectionPool, DatabaseExecutor
+from . import journal
+from .migrations import migrate, split_loadout
+from .records import InventoryRow, ItemRow, Player, Profile, columns, fetch_record, fetch_records
+
+
+def reads(fn):
+    fn._db_mode = "read"
+    return fn
+
+
+def writes(fn):
+    fn._db_mode = "write"
+    return fn
+
+
+def _dict_factory(cursor, row):
+    d = {}
+    for idx, col in enumerate(cursor.description):
+        d[col[0]] = row[idx]
+    return d
+
+
+READER_CONNECTIONS = 4
+
+
+class InventoryShortage(Exception):
+    '''事务内扣除物品时数量不足。'''
+
+
+class VersionConflict(Exception):
+    '''玩家记录在读取之后已被其他写入者更新。'''
+
+
+class XiuXianStorage:
+    '''修仙插件的全部 SQL。方法均为同步阻塞调用，由 AsyncStorage 派发到数据库线程执行。
+
+    下面按分区（玩家、功法与装备、排行榜、物品与储物戒、经济流水、备份）列出的 @reads / @writes 方法
+    就是存储后端的接口，backends.ShardedStorage 以同样的方法把玩家分散到多个库中。
+    db_file 为 ":memory:" 时为纯内存库，插件卸载后数据即丢弃。
+    '''
+
+    # AsyncStorage 为写操作准备的写通道数，写方法的 _lanes(self, *参数) 给出它会写到的通道，未标注时占用全部通道
+    write_lanes = 1
+
+    def __init__(self, db_file, readers: int = READER_CONNECTIONS):
+        self.db = ConnectionPool(db_file, row_factory=_dict_factory, readers=readers)
+
+    def close(self):
+        self.db.close()
+
+    def shard_of(self, user_id: str) -> "XiuXianStorage":
+        '''存放该玩家数据的库；单库时就是自身。'''
+        return self
+
+    # --- 初始化 ---
+
+    def init_database(self, initial_items):
+        '''按 PRAGMA user_version 执行尚未完成的迁移步骤，见 migrations.py。'''
+        migrate(self.db, initial_items)
+
+    # --- 玩家 ---
+
+    @reads
+    def get_player(self, user_id: str):
+        with self.db.reader() as cursor:
+            return fetch_record(cursor, Player, f"SELECT {columns(Player)} FROM players WHERE user_id = ?", (user_id,))
+
+    @writes
+    def update_player(self, user_id: str, data: dict):
+        updates = ", ".join([f"{key} = ?" for key in data.keys()])
+        values = list(data.values())
+        values.append(user_id)
+        with self.db.writer() as cursor:
+            cursor.execute(f"UPDATE players SET {updates} WHERE user_id = ?", tuple(values))
+
+    @writes
+    def update_players(self, batch: dict, events=()):
+        '''在一个事务中批量写回多名玩家的字段与对应的经济流水，batch 形如 {user_id: {字段: 值}}。'''
+        with self.db.writer() as cursor:
+            self._update_players(cursor, batch)
+            journal.write_events(cursor, events)
+
+    def _update_players(self, cursor, batch: dict):
+        groups = {}
+        for user_id, data in batch.items():
+            keys = tuple(sorted(data))
+            groups.setdefault(keys, []).append(tuple(data[key] for key in keys) + (user_id,))
+        for keys, rows in groups.items():
+            updates = ", ".join([f"{key} = ?" for key in keys])
+            cursor.executemany(f"UPDATE players SET {updates} WHERE user_id = ?", rows)
+
+    @writes
+    def settle_seclusion(self, batch: dict, events, now: float, exp_per_minute: int, root_rates: dict):
+        '''先写回 batch 中的缓存脏字段，再用一条 UPDATE 结算所有闭关玩家截至 now 的修为。
+
+        算式与 XiuXianPlugin._seclusion_exp 一致；被动加成缓存列尚为 NULL 的旧玩家留待读入时结算。
+        结算所得同时累加到 seclusion_banked_exp，出关时与未结算的部分一起汇报。
+        返回被结算玩家的 user_id、exp、seclusion_banked_exp 与 seclusion_start_time。
+        '''
+        with self.db.writer() as cursor:
+            self._update_players(cursor, batch)
+            journal.write_events(cursor, events)
+            return self._settle(cursor, now, exp_per_minute, root_rates)
+
+    def _settle(self, cursor, now: float, exp_per_minute: int, root_rates: dict):
+        rate_case = "CASE spirit_root " + " ".join("WHEN ? THEN ?" for _ in root_rates) + " END"
+        rate_params = [value for item in root_rates.items() for value in item]
+        gained = f"CAST((? - seclusion_start_time) / 60 * ? * {rate_case} * exp_rate AS INTEGER)"
+        gained_params = (now, exp_per_minute, *rate_params)
+        cursor.execute(
+            f"UPDATE players SET exp = exp + {gained}, seclusion_banked_exp = seclusion_banked_exp + {gained}, "
+            f"seclusion_start_time = ? WHERE is_seclusion = 1 AND seclusion_start_time < ? AND exp_rate IS NOT NULL "
+            f"AND spirit_root IN ({','.join('?' for _ in root_rates)})",
+            (*gained_params, *gained_params, now, now, *root_rates))
+        cursor.execute("SELECT user_id, exp, seclusion_banked_exp, seclusion_start_time FROM players "
+                       "WHERE is_seclusion = 1 AND seclusion_start_time = ?", (now,))
+        return cursor.fetchall()
+
+    @writes
+    def create_player(self, user_id: str, nickname: str, gold: int, spirit_root: str, created_at: str):
+        with self.db.writer() as cursor:
+            cursor.execute(
+                "INSERT INTO players (user_id, nickname, gold, spirit_root, created_at) VALUES (?, ?, ?, ?, ?)",
+                (user_id, nickname, gold, spirit_root, created_at))
+            journal.write_events(cursor, [journal.make_event(user_id, "create", gold)])
+
+    @reads
+    def has_reset_on(self, user_id: str, reset_date: str) -> bool:
+        with self.db.reader() as cursor:
+            cursor.execute("SELECT 1 FROM reset_logs WHERE user_id = ? AND reset_date = ?", (user_id, reset_date))
+            return cursor.fetchone() is not None
+
+    @writes
+    def reset_player(self, user_id: str, reset_date: str):
+        with self.db.writer() as cursor:
+            cursor.execute("DELETE FROM players WHERE user_id = ?", (user_id,))
+            cursor.execute("DELETE FROM inventory WHERE user_id = ?", (user_id,))
+            cursor.execute("DELETE FROM player_skills WHERE user_id = ?", (user_id,))
+            cursor.execute("DELETE FROM player_equipment WHERE user_id = ?", (user_id,))
+            cursor.execute("DELETE FROM group_members WHERE user_id = ?", (user_id,))
+            cursor.execute("DELETE FROM sects WHERE leader_id = ?", (user_id,))
+            cursor.execute("INSERT INTO reset_logs (user_id, reset_date) VALUES (?, ?)", (user_id, reset_date))
+            journal.write_events(cursor, [journal.make_event(user_id, "reset")])
+
+    @reads
+    def get_sect_name(self, sect_id: int):
+        with self.db.reader() as cursor:
+            cursor.execute("SELECT name FROM sects WHERE id = ?", (sect_id,))
+            sect = cursor.fetchone()
+        return sect['name'] if sect else None
+
+    # --- 功法与装备 ---
+
+    @reads
+    def get_loadout(self, user_id: str):
+        '''返回 (功法 {名称: 数据}, 装备 {部位: item_id})，用于全量计算被动加成。'''
+        with self.db.reader() as cursor:
+            cursor.execute("SELECT skill_name, data FROM player_skills WHERE user_id = ?", (user_id,))
+            skills = {row['skill_name']: json.loads(row['data']) for row in cursor.fetchall()}
+            cursor.execute("SELECT slot, item_id FROM player_equipment WHERE user_id = ?", (user_id,))
+            equipment = {row['slot']: row['item_id'] for row in cursor.fetchall()}
+        return skills, equipment
+
+    @reads
+    def has_skill(self, user_id: str, skill_name: str) -> bool:
+        with self.db.reader() as cursor:
+            cursor.execute("SELECT 1 FROM player_skills WHERE user_id = ? AND skill_name = ?", (user_id, skill_name))
+            return cursor.fetchone() is not None
+
+    @reads
+    def get_equipped(self, user_id: str, slot: str):
+        with self.db.reader() as cursor:
+            cursor.execute("SELECT item_id FROM player_equipment WHERE user_id = ? AND slot = ?", (user_id, slot))
+            row = cursor.fetchone()
+            return row['item_id'] if row else None
+
+    # --- 排行榜 ---
+
+    @reads
+    def get_ranking_profiles(self):
+        with self.db.reader() as cursor:
+            return fetch_records(cursor, Profile, f"SELECT {columns(Profile)} FROM players")
+
+    @reads
+    def get_group_members(self):
+        with self.db.reader() as cursor:
+            cursor.execute("SELECT group_id, user_id FROM group_members")
+            return cursor.fetchall()
+
+    @writes
+    def add_group_members(self, pairs):
+        '''批量记录 (group_id, user_id)，已存在的忽略。'''
+        with self.db.writer() as cursor:
+            cursor.executemany("INSERT OR IGNORE INTO group_members (group_id, user_id) VALUES (?, ?)", pairs)
+
+    # --- 物品与储物戒 ---
+
+    def get_items(self):
+        with self.db.reader() as cursor:
+            return fetch_records(cursor, ItemRow, f"SELECT {columns(ItemRow)} FROM items")
+
+    @reads
+    def get_inventory(self, user_id: str):
+        with self.db.reader() as cursor:
+            return fetch_records(
+                cursor, InventoryRow,
+                "SELECT i.item_id, i.quantity, e.slot IS NOT NULL AS is_equipped FROM inventory AS i "
+                "LEFT JOIN player_equipment AS e ON e.user_id = i.user_id AND e.item_id = i.item_id "
+                "WHERE i.user_id = ? ORDER BY i.id", (user_id,))
+
+    @reads
+    def get_item_quantities(self, user_id: str, item_ids) -> dict:
+        if not item_ids:
+            return {}
+        with self.db.reader() as cursor:
+            cursor.execute(
+                f"SELECT item_id, quantity FROM inventory WHERE user_id = ? AND item_id IN ({','.join('?' for _ in item_ids)})",
+                (user_id, *item_ids))
+            return {row['item_id']: row['quantity'] for row in cursor.fetchall()}
+
+    @reads
+    def has_item(self, user_id: str, item_id: int) -> bool:
+        with self.db.reader() as cursor:
+            cursor.execute("SELECT id FROM inventory WHERE user_id = ? AND item_id = ?", (user_id, item_id))
+            return cursor.fetchone() is not None
+
+    @reads
+    def get_item_quantity(self, user_id: str, item_id: int) -> int:
+        with self.db.reader() as cursor:
+            cursor.execute("SELECT quantity FROM inventory WHERE user_id = ? AND item_id = ?", (user_id, item_id))
+            row = cursor.fetchone()
+            return row['quantity'] if row else 0
+
+    def _add_item(self, cursor, user_id: str, item_id: int, quantity: int):
+        cursor.execute(
+            "INSERT INTO inventory (user_id, item_id, quantity) VALUES (?, ?, ?) ON CONFLICT (user_id, item_id) DO UPDATE SET quantity = quantity + excluded.quantity",
+            (user_id, item_id, quantity))
+
+    def _remove_item(self, cursor, user_id: str, item_id: int, quantity: int) -> bool:
+        cursor.execute("UPDATE inventory SET quantity = quantity - ? WHERE user_id = ? AND item_id = ? AND quantity >= ?",
+                       (quantity, user_id, item_id, quantity))
+        if not cursor.rowcount:
+            return False
+        cursor.execute("DELETE FROM inventory WHERE user_id = ? AND item_id = ? AND quantity <= 0", (user_id, item_id))
+        return True
+
+    @writes
+    def commit_unit(self, player_updates: dict, inventory_ops: list, events=(), versions=None):
+        '''在一个事务中写入一条指令的全部改动及其经济流水。
+
+        inventory_ops 为按顺序执行的 (操作, user_id, 键, 数值)：add / remove 的键为 item_id、数值为数量，
+        equip 的键为部位、数值为 item_id，learn 的键为功法名、数值为功法数据的 JSON；
+        player_updates 形如 {user_id: {字段: 值}}。
+        versions 为 {user_id: 读取时的版本号}：库中版本号更大说明已被别处写过，抛出 VersionConflict。
+        库中版本号可以更小，那是写回缓存里尚未落盘的提交。
+        任一物品数量不足、版本冲突或功法已学会时整个事务回滚。
+        '''
+        with self.db.writer() as cursor:
+            self._commit_unit(cursor, player_updates, inventory_ops, events, versions or {})
+
+    def _commit_unit(self, cursor, player_updates: dict, inventory_ops: list, events, versions: dict):
+        for op, user_id, key, value in inventory_ops:
+            if op == "add":
+                self._add_item(cursor, user_id, key, value)
+            elif op == "remove":
+                if not self._remove_item(cursor, user_id, key, value):
+                    raise InventoryShortage(user_id, key, value)
+            elif op == "equip":
+                cursor.execute(
+                    "INSERT INTO player_equipment (user_id, slot, item_id) VALUES (?, ?, ?) "
+                    "ON CONFLICT (user_id, slot) DO UPDATE SET item_id = excluded.item_id", (user_id, key, value))
+            elif op == "learn":
+                cursor.execute(
+                    "INSERT INTO player_skills (user_id, skill_name, data) VALUES (?, ?, ?) ON CONFLICT DO NOTHING",
+                    (user_id, key, value))
+                if not cursor.rowcount:
+                    raise VersionConflict(user_id, key)
+            else:
+                raise ValueError(f"未知的储物戒操作: {op}")
+        for user_id, data in player_updates.items():
+            updates = ", ".join([f"{key} = ?" for key in data.keys()])
+            if user_id in versions:
+                cursor.execute(f"UPDATE players SET {updates} WHERE user_id = ? AND version <= ?",
+                               (*data.values(), user_id, versions[user_id]))
+                if not cursor.rowcount:
+                    raise VersionConflict(user_id, versions[user_id])
+            else:
+                cursor.execute(f"UPDATE players SET {updates} WHERE user_id = ?", (*data.values(), user_id))
+        journal.write_events(cursor, events)
+
+    # --- 经济流水 ---
+
+    @reads
+    def audit_economy(self, user_id: str = None) -> list:
+        with self.db.reader() as cursor:
+            # 快照、流水与余额在同一个读事务中读取
+            cursor.execute("BEGIN")
+            return journal.audit(cursor, user_id)
+
+    @writes
+    def compact_journal(self, before_ts: int) -> int:
+        with self.db.writer() as cursor:
+            return journal.compact(cursor, before_ts)
+
+    # --- 备份与导入导出 ---
+
+    @reads
+    def backup_to(self, target, pages_per_step: int):
+        '''用 SQLite 在线备份 API 把数据库复制到 target。
+
+        源为只读连接，每步只复制 pages_per_step 页；WAL 模式下写连接照常提交，
+        备份期间源库有改动时由 SQLite 自动从头补拷，得到的仍是一致的快照。
+        '''
+        dst = sqlite3.connect(str(target))
+        try:
+            with self.db.reader() as cursor:
+                cursor.connection.backup(dst, pages=pages_per_step)
+        finally:
+            dst.close()
+
+    @reads
+    def export_jsonl(self, path) -> dict:
+        '''把玩家、储物戒、宗门逐行流式导出为 gzip 压缩的 JSONL，返回各表行数。'''
+        with self.db.reader() as cursor:
+            # 各表在同一个读事务中导出，内容对应同一时刻
+            cursor.execute("BEGIN")
+            conn = cursor.connection
+            return write_jsonl(path, ((table, conn.execute(f"SELECT * FROM {table} ORDER BY rowid"))
+                                      for table in EXPORT_TABLES))
+
+    @writes
+    def import_jsonl(self, path) -> dict:
+        '''在一个事务中导入 export_jsonl 的文件，主键相同的记录被覆盖；文件中多出的列忽略。返回各表行数。'''
+        with self.db.writer() as cursor:
+            return import_jsonl_into(path, [cursor], lambda table, row: 0)
+
+
+def import_jsonl_into(path, cursors, route) -> dict:
+    '''把 export_jsonl 的文件写入 cursors 对应的库，route(表名, 行) 返回该行所属库在 cursors 中的下标。'''
+    counts = {}
+    batches = {}
+    columns = {}
+    for table in EXPORT_TABLES:
+        cursors[0].execute(f"PRAGMA table_info({table})")
+        columns[table] = {col['name'] for col in cursors[0].fetchall()} - IMPORT_SKIP_COLUMNS.get(table, set())
+    for table, row in read_jsonl(path):
+        if table not in columns:
+            raise ValueError(f"导入文件包含未知的表: {table}")
+        keys = tuple(key for key in row if key in columns[table])
+        index = route(table, row)
+        batch = batches.setdefault((index, table, keys), [])
+        batch.append(tuple(row[key] for key in keys))
+        counts[table] = counts.get(table, 0) + 1
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            _insert_rows(cursors[index], table, keys, batch)
+            batch.clear()
+    for (index, table, keys), batch in batches.items():
+        if batch:
+            _insert_rows(cursors[index], table, keys, batch)
+    for cursor in cursors:
+        # 旧版本导出的玩家行仍带功法与装备的 JSON
+        split_loadout(cursor)
+        # 导入的余额没有对应流水，以导入后的状态作为新的快照起点
+        journal.rebase(cursor)
+    return counts
+
+
+def _insert_rows(cursor, table: str, keys, rows):
+    cursor.executemany(
+        f"INSERT OR REPLACE INTO {table} ({', '.join(keys)}) VALUES ({', '.join('?' for _ in keys)})", rows)
+
+
+class AsyncStorage:
+    '''XiuXianStorage 的异步外观：带 @reads/@writes 标记的方法在调用时即提交到 DatabaseExecutor 的线程，
+    返回 future 供指令处理函数 await；写入按调用的先后顺序执行。'''
+
+    def __init__(self, storage: XiuXianStorage):
+        self._storage = storage
+        self._executor = DatabaseExecutor(readers=READER_CONNECTIONS, write_lanes=storage.write_lanes)
+
+    def __getattr__(self, name):
+        fn = getattr(self._storage, name)
+        mode = getattr(fn, "_db_mode", None)
+        if mode is None:
+            raise AttributeError(f"{name} 不是可异步调用的存储方法")
+        if mode == "write":
+            route = getattr(fn, "_lanes", None)
+            all_lanes = range(self._storage.write_lanes)
+
+            def call(*args, **kwargs):
+                lanes = route(self._storage, *args, **kwargs) if route else all_lanes
+                return self._executor.run_write(lanes or all_lanes, fn, *args, **kwargs)
+        else:
+            def call(*args, **kwargs):
+                return self._executor.run_read(fn, *args, **kwargs)
+
+        call.__name__ = name
+        setattr(self, name, call)
+        return call
+
+    def close(self):
+        self._executor.shutdown()
+        self._storage.close()
@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+
+class RateLimiter:
+    '''按键（玩家或群）计数的令牌桶。
+
+    每个键最多攒 burst 个令牌，每秒恢复 rate 个，每条指令消耗一个，没有令牌时拒绝。
+    桶在第一次使用时创建；攒满的桶与新建的桶等价，定期清理以免长期占用内存。
+    rate 为 0 表示不限流。
+    '''
+
+    PRUNE_INTERVAL = 60
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = max(0.0, rate)
+        self.burst = max(1, burst)
+        # {key: [剩余令牌, 上次更新时间]}
+        self._buckets = {}
+        self._pruned_at = time.monotonic()
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, key, now: float = None) -> bool:
+        if not self.rate:
+            return True
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if now - self._pruned_at > self.PRUNE_INTERVAL:
+            self._prune(now)
+        if bucket[0] < 1:
+            self.rejected += 1
+            return False
+        bucket[0] -= 1
+        return True
+
+    def _prune(self, now: float):
+        self._pruned_at = now
+        refill = self.burst / self.rate
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if now - bucket[1] < refill}
+
+
+class Coalescer:
+    '''合并短时间内相同的只读请求。
+
+    同一个键的计算进行中时，后来的请求等待同一个结果；计算完成后的 window 秒内直接复用该结果。
+    计算抛出异常时不缓存，等待中的请求一同收到该异常。window 为 0 时只合并进行中的请求。
+    '''
+
+    def __init__(self, window: float):
+        self.window = max(0.0, window)
+        # {key: (完成时间, 结果)}
+        self._results = {}
+        self._inflight = {}
+        self.hits = 0
+
+    async def run(self, key, compute):
+        '''compute 为无参协程函数。'''
+        now = time.monotonic()
+        cached = self._results.get(key)
+        if cached is not None:
+            if now - cached[0] < self.window:
+                self.hits += 1
+                return cached[1]
+            del self._results[key]
+        future = self._inflight.get(key)
+        if future is not None:
+            self.hits += 1
+            return await asyncio.shield(future)
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            if self.window:
+                self._expire(now)
+                self._results[key] = (time.monotonic(), result)
+            return result
+        finally:
+            del self._inflight[key]
+
+    def _expire(self, now: float):
+        expired = [key for key, (done, _) in self._results.items() if now - done >= self.window]
+        for key in expired:
+            del self._results[key]
@@ -0,0 +1,92 @@
+import json
+from astrbot.api import logger
+from .journal import make_event
+from .storage import InventoryShortage, VersionConflict
+
+
+class UnitOfWork:
+    '''一条指令的工作单元。
+
+    玩家记录在单元内只读取一次，之后的改动都先记在单元里，由处理函数在回复前调用一次 commit()：
+    只改玩家字段时交给写回缓存，不产生提交；涉及储物戒时连同玩家字段在同一个事务里写库，
+    灵石与物品的转移要么全部生效，要么全部回滚。未调用 commit() 的改动直接丢弃。
+    提交时按 kind 为灵石与物品数量的变化生成经济流水，与改动一同落盘。
+    每次提交把改动玩家的 version 加一；读取后 version 已被别的写入改过时放弃提交（乐观并发控制）。
+    '''
+
+    def __init__(self, plugin, kind: str):
+        self._plugin = plugin
+        self._kind = kind
+        self._players = {}
+        self._gold_before = {}
+        self._versions = {}
+        self._updates = {}
+        self._inventory_ops = []
+
+    async def player(self, user_id: str, calculate_exp: bool = True):
+        '''读取玩家记录；同一单元内重复读取返回同一个已叠加本单元改动的字典。'''
+        if user_id not in self._players:
+            player = self._players[user_id] = await self._plugin._get_player(user_id, calculate_exp)
+            if player:
+                self._gold_before[user_id] = player["gold"]
+                self._versions[user_id] = player.get("version") or 0
+        return self._players[user_id]
+
+    def update(self, user_id: str, data: dict):
+        player = self._players.get(user_id)
+        if player is not None:
+            player.update(data)
+        self._updates.setdefault(user_id, {}).update(data)
+
+    def add_item(self, user_id: str, item_id: int, quantity: int = 1):
+        self._inventory_ops.append(("add", user_id, item_id, quantity))
+
+    def remove_item(self, user_id: str, item_id: int, quantity: int = 1):
+        self._inventory_ops.append(("remove", user_id, item_id, quantity))
+
+    def equip(self, user_id: str, slot: str, item_id: int):
+        self._inventory_ops.append(("equip", user_id, slot, item_id))
+
+    def learn(self, user_id: str, skill_name: str, data: dict):
+        self._inventory_ops.append(("learn", user_id, skill_name, json.dumps(data, ensure_ascii=False)))
+
+    def _events(self, updates: dict, ops: list) -> list:
+        gold = {user_id: data["gold"] - self._gold_before[user_id] for user_id, data in updates.items()
+                if "gold" in data and user_id in self._gold_before and data["gold"] != self._gold_before[user_id]}
+        events = []
+        for op, user_id, item_id, value in ops:
+            if op in ("add", "remove"):
+                # 灵石变化并入该玩家的第一条物品流水，买卖只占一行
+                events.append(make_event(user_id, self._kind, gold.pop(user_id, 0), item_id,
+                                         value if op == "add" else -value))
+        events.extend(make_event(user_id, self._kind, delta) for user_id, delta in gold.items())
+        return events
+
+    async def commit(self) -> bool:
+        '''提交全部改动；储物戒中物品不足时整体回滚并返回 False。'''
+        updates, ops = self._updates, self._inventory_ops
+        self._updates, self._inventory_ops = {}, []
+        versions = {user_id: self._versions[user_id] for user_id in updates if user_id in self._versions}
+        for user_id, version in versions.items():
+            current = self._plugin.player_cache.peek(user_id, "version")
+            if current is not None and current != version:
+                logger.warning(f"玩家 {user_id} 的记录在本次指令读取后已被修改，放弃提交。")
+                return False
+            updates[user_id]["version"] = version + 1
+        events = self._events(updates, ops)
+        if not ops:
+            for user_id, data in updates.items():
+                await self._plugin._update_player(user_id, data)
+            # 只改玩家字段时流水随缓存写回入库
+            self._plugin.journal.extend(events)
+            return True
+        try:
+            await self._plugin.store.commit_unit(updates, ops, events, versions)
+        except InventoryShortage:
+            return False
+        except VersionConflict as e:
+            logger.warning(f"玩家 {e.args[0]} 的数据库记录版本已变化，放弃提交。")
+            return False
+        for user_id, data in updates.items():
+            self._plugin._apply_persisted(user_id, data)
+        return True